@@ -1,7 +1,9 @@
-import random
 from environment import Agent, Environment
-from planner import RoutePlanner
+from planner import ShortestPathPlanner
 from simulator import Simulator
+from events import ConsoleSink, DEBUG
+from qtable import QTable
+from metrics import RollingMetrics
 
 # import packages for statistics and data analysis
 import pandas as pd
@@ -11,38 +13,48 @@ import matplotlib.pyplot as plt
 class LearningAgent(Agent):
     """An agent that learns to drive in the smartcab world."""
 
-    def __init__(self, env):
+    def __init__(self, env, gamma=0.03, alpha=1, optimism=5, n_trials=100, qtable=None):
         '''
         sets self.env = env, state = None, next_waypoint = None,
         and a default color
+
+        gamma, alpha and optimism are the Q-learning parameters described
+        below; n_trials sizes the per-trial statistics arrays.  qtable
+        is a QTable shared with other learners (see create_learners()),
+        by default the agent has its own.
         '''
         super(LearningAgent, self).__init__(env)
         
         # override color
         self.color = 'red'
         
-        # simple route planner to get next_waypoint
-        self.planner = RoutePlanner(self.env, self)
+        # route planner to get next_waypoint, aware of the wrap-around
+        self.planner = ShortestPathPlanner(self.env, self)
         
         # TODO: Initialize any additional variables here
         self.actions = (None, 'forward', 'left', 'right')
         self.state = None
         
         # Initialize variables for statistics tracking
-        self.N = 100
+        # (arrays grow past n_trials if needed, see track())
+        self.N = n_trials
         self.success = np.zeros(self.N)
         self.invalid = np.zeros(self.N)
         self.wander = np.zeros(self.N)
         self.trial = 0
         self.trips_failed = 0
+        self.recorder = None # records every step when set, see recorder.py
+        self.metrics = None # online statistics when set, see metrics.py
+        self.replay = None # experience replay when set, see replay.py
         
         # Variables related to Q-learning
-        self.Qtable = {} # The Q-Table
-        self.weights = [0, 0, 0, 0] # stores preferences for current act
-        self.Qiterations = {} # used to reduce alpha
-        self.alpha = 1 # initial learning rate
-        self.gamma = 0.03 # the discount factor
-        self.optimism = 5 # the Q-Value to assign new states
+        self.initial_alpha = alpha # initial learning rate
+        self.alpha = alpha # current learning rate
+        self.gamma = gamma # the discount factor
+        self.optimism = optimism # the Q-Value to assign new states
+        self.Qtable = qtable if qtable is not None else QTable(self.optimism) # Q-values and visit counts
+        self.policy = None # greedy action per state once frozen, see freeze()
+        self.max_dQ = 0.0 # largest change to a Q-value in the current trial
         '''
         At a gamma of 1, the car remains stationary always.
         At a gamma of 0.9, the car very quickly favors looping.
@@ -54,11 +66,32 @@ class LearningAgent(Agent):
         not reappear, even up to 100 trials.
         '''
 
+    def freeze(self, rng=None):
+        '''
+        Stops learning: from now on update() takes the highest-Q action
+        of each state from a precomputed table, in one lookup, and no
+        longer updates the Q-table.  Ties are broken once, here.
+        '''
+        self.policy = self.Qtable.greedy_actions(rng if rng is not None else self.rng).tolist()
+
+    def unfreeze(self):
+        '''Resumes learning in update().'''
+        self.policy = None
+
     def reset(self, destination=None):
         self.planner.route_to(destination)
+        self.max_dQ = 0.0
         # TODO: Prepare for a new trip; reset any variables here, if
         # required
 
+    def update_waypoint(self):
+        '''Sets next_waypoint from the planner, for the current location.'''
+        waypoint = self.planner.next_waypoint()
+        if waypoint != self.next_waypoint:
+            # other agents here sense it, see Environment.sense()
+            self.env.invalidate(self.env.get_location(self))
+            self.next_waypoint = waypoint
+
     def get_state(self):
         '''
         Returns the state vector of the smartcab, according to
@@ -77,7 +110,7 @@ class LearningAgent(Agent):
         # 
         # Very quickly, then, this would lead the car to remain
         # stationary (and wait for the destination to come to it?).
-        self.next_waypoint = self.planner.next_waypoint()
+        self.update_waypoint()
         
         # Gather inputs
         # from route planner, also displayed by simulator
@@ -90,85 +123,15 @@ class LearningAgent(Agent):
         return (self.next_waypoint, inputs['light'], 
             inputs['left'], inputs['oncoming'])
     
-    def update(self, t):
+    def track(self, deadline, action, reward):
         '''
-        Takes the next "best" action as defined by the Q-Learning
-        algorithm.
-        
-        First, the smartcab determines its state (that is, which action
-        the route planner suggests next, the current light color, where
-        the nearby cars are, and in which direction are those cars
-        travelling).
-        
-        Next, the smartcab determines the cost or benefit of the
-        potential actions it could take.  These potential actions,
-        as defined in the constructor, are to remain stationary, or to
-        go forward, left, or right.  For more information about the
-        costs and benefits, consult environment.Environment.act().
-        
-        The smartcab then takes the action with the highest benefit.
-        If multiple actions tie for the highest benefit, one of the
-        tieing actions is chosen at random.
-        
-        The smartcab then peeks ahead to the highest possible benefit
-        which can be obtained from the next action it would take,
-        and uses that value to update its Q-Learning model.
-        
-        More precisely, the Q-Learning model is a table of state-action
-        pairs, combined with preferences.  The adjustement of those
-        preferences over time is the result of the Q-Learning algorithm.
-        
-        After a sufficiently-long training period (where the smartcab
-        has explored the state-action pair space), it is the hope that
-        the smartcab will "know" the correct action to take in order to
-        get to its destination along the best route, without taking
-        invalid (harmful, dangerous, illegal) actions.
+        Updates the per-trial statistics (success, invalid and
+        off-waypoint actions) after taking action in self.state.
         '''
-        # Begin by initializing the smartcab's state vector
-        self.state = self.get_state()
-        
-        # Get the current deadline
-        deadline = self.env.get_deadline(self)
-        
-        # Select action according to your policy
-        # If a state-action pair hasn't been considered yet, award
-        # it a high initial Q value, to favor exploring new options
-        #
-        # While "exploring new options" is lamentable for a smartcab
-        # with live passengers, it is also perhaps the only way to
-        # traverse the reward-space during training.
-        for i, action in enumerate(self.actions):
-            self.weights[i] = \
-                self.Qtable.setdefault((self.state, action), self.optimism)
+        if self.trial >= self.N:
+            self.grow()
+        trial = self.trial
 
-        # The next action is the highest-Q-value action
-        # if tie, the next action is randomly chosen from among ties
-        current_max = max(self.weights)
-        action_ties = [i for i, w in enumerate(self.weights) if w == current_max]
-        action = self.actions[random.choice(action_ties)]
-        
-        # Keep track of how many times this action was chosen for
-        # this state, and reduce alpha accordingly.
-        #
-        # If a state-action pair has never been seen before, then
-        # the smartcab should learn as much as it can from this new
-        # scenario.
-        #
-        # If a state-action pair has already occurred frequently,
-        # then the smartcab should retain comparatively more of the
-        # knowledge it already possesses about that state-action pair,
-        # and should not "learn" as much from encountering the same
-        # scenario again.
-        iterations = self.Qiterations.setdefault((self.state, action),
-            1)
-        self.Qiterations[(self.state, action)] += 1
-        self.alpha = 1.0 / iterations
-        
-        # Execute action and get reward
-        reward = self.env.act(self, action)
-        
-        # Track statistics
-        
         # Generally, we want to consider the trial over if the smartcab
         # reaches its destination.
         #
@@ -178,12 +141,12 @@ class LearningAgent(Agent):
         # which agreed with the next waypoint (reward = 2), _and_
         # because it reached the destination (reward += 10).
         # 
-        # However, the Route Planner is **not** perfect, and will
+        # However, the simple RoutePlanner is **not** perfect, and will
         # very rarely suggest a path to the smartcab which is not the
         # correct next move to get closer to the destination.
-        # This is probably due to the grid being continuous, rather than
+        # This is due to the grid being continuous, rather than
         # bounded and purely Euclidean, space (e.g. can travel left by
-        # going far enough right).
+        # going far enough right); ShortestPathPlanner accounts for it.
         # 
         # For example:
         '''
@@ -235,20 +198,130 @@ class LearningAgent(Agent):
             self.trial += 1
         elif reward > 9: # destination reached by off-waypoint action
             self.success[self.trial] = 1
-            self.trial += 1
-            print "Negative {},{},{},{},{},{},{}".format(self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
+            if self.env.sink.level <= DEBUG:
+                self.env.sink.emit(DEBUG, 'negative', self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
             self.wander[self.trial] += 1
+            self.trial += 1
         elif deadline == 0:
             self.trial += 1
             self.trips_failed += 1
         elif reward == -1:
-            print "Negative {},{},{},{},{},{},{}".format(self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
+            if self.env.sink.level <= DEBUG:
+                self.env.sink.emit(DEBUG, 'negative', self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
             self.invalid[self.trial] += 1
         elif reward == -0.5:
-            print "Negative {},{},{},{},{},{},{}".format(self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
+            if self.env.sink.level <= DEBUG:
+                self.env.sink.emit(DEBUG, 'negative', self.trial, self.state[0], self.state[1], self.state[2], self.state[3], action, reward)
             self.wander[self.trial] += 1
+
+        if self.metrics is not None:
+            self.metrics.add_step(reward)
+            if self.trial != trial: # trial over
+                self.metrics.end_trial(self.success[trial], self.invalid[trial], self.wander[trial])
+
+    def grow(self):
+        '''Doubles the size of the per-trial statistics arrays.'''
+        self.N *= 2
+        for name in ('success', 'invalid', 'wander'):
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate((values, np.zeros(self.N - len(values)))))
+
+    def update(self, t):
+        '''
+        Takes the next "best" action as defined by the Q-Learning
+        algorithm.
+        
+        First, the smartcab determines its state (that is, which action
+        the route planner suggests next, the current light color, where
+        the nearby cars are, and in which direction are those cars
+        travelling).
+        
+        Next, the smartcab determines the cost or benefit of the
+        potential actions it could take.  These potential actions,
+        as defined in the constructor, are to remain stationary, or to
+        go forward, left, or right.  For more information about the
+        costs and benefits, consult environment.Environment.act().
         
+        The smartcab then takes the action with the highest benefit.
+        If multiple actions tie for the highest benefit, one of the
+        tieing actions is chosen at random.
+        
+        The smartcab then peeks ahead to the highest possible benefit
+        which can be obtained from the next action it would take,
+        and uses that value to update its Q-Learning model.
+        
+        More precisely, the Q-Learning model is a table of state-action
+        pairs, combined with preferences.  The adjustement of those
+        preferences over time is the result of the Q-Learning algorithm.
         
+        After a sufficiently-long training period (where the smartcab
+        has explored the state-action pair space), it is the hope that
+        the smartcab will "know" the correct action to take in order to
+        get to its destination along the best route, without taking
+        invalid (harmful, dangerous, illegal) actions.
+        '''
+        # Begin by initializing the smartcab's state vector
+        self.state = self.get_state()
+        
+        # Get the current deadline
+        deadline = self.env.get_deadline(self)
+        
+        # Frozen policy: act greedily, without learning
+        if self.policy is not None:
+            action = self.actions[self.policy[self.Qtable.encode(self.state)]]
+            if self.recorder is not None:
+                location = self.env.get_location(self)
+            reward = self.env.act(self, action)
+            self.update_waypoint() # as get_state() would, for the other agents
+            self.track(deadline, action, reward)
+            if self.recorder is not None:
+                self.recorder.record(self.env.trial, t, self.state, action, reward, location, deadline)
+            return
+        
+        # Select action according to your policy
+        # If a state-action pair hasn't been considered yet, it still
+        # holds the high initial Q value from the Q-table, to favor
+        # exploring new options
+        #
+        # While "exploring new options" is lamentable for a smartcab
+        # with live passengers, it is also perhaps the only way to
+        # traverse the reward-space during training.
+        s = self.Qtable.encode(self.state)
+        weights = self.Qtable.Q[s].tolist()
+
+        # The next action is the highest-Q-value action
+        # if tie, the next action is randomly chosen from among ties
+        current_max = max(weights)
+        action_ties = [i for i, w in enumerate(weights) if w == current_max]
+        a = self.rng.choice(action_ties)
+        action = self.actions[a]
+        
+        # Keep track of how many times this action was chosen for
+        # this state, and reduce alpha accordingly.
+        #
+        # If a state-action pair has never been seen before, then
+        # the smartcab should learn as much as it can from this new
+        # scenario.
+        #
+        # If a state-action pair has already occurred frequently,
+        # then the smartcab should retain comparatively more of the
+        # knowledge it already possesses about that state-action pair,
+        # and should not "learn" as much from encountering the same
+        # scenario again.
+        iterations = self.Qtable.visits[s, a]
+        self.Qtable.visits[s, a] += 1
+        self.alpha = float(self.initial_alpha) / iterations
+        
+        # Execute action and get reward
+        if self.recorder is not None:
+            location = self.env.get_location(self)
+        reward = self.env.act(self, action)
+        
+        # Track statistics
+        self.track(deadline, action, reward)
+        if self.recorder is not None:
+            self.recorder.record(self.env.trial, t, self.state, action, reward, location, deadline)
+
         # Learn policy based on state, action, reward
         
         # Peek ahead to store the next state to s' (state_prime)
@@ -265,27 +338,52 @@ class LearningAgent(Agent):
         # any of the next actions we _could_ take.
         #
         # Here again, if we have not previously encountered a particular
-        # state-action pair, we award a high initial Q value to favor
+        # state-action pair, it holds a high initial Q value to favor
         # exploring new options.
-        for i, action_prime in enumerate(self.actions):
-            self.weights[i] = self.Qtable.setdefault((state_prime,
-                action_prime), self.optimism)
-        self.maxQ_new = max(self.weights)
+        s_prime = self.Qtable.encode(state_prime)
+        self.maxQ_new = self.Qtable.Q[s_prime].max()
         
         # Update Q for the current state with the just-calculated
         # utility for the next state
         # 
         # This is the equation from the "Estimating Q from Transitions"
         # Udacity video
-        self.Qtable[(self.state, action)] = \
-            (1.0 - self.alpha) * self.Qtable[(self.state, action)] + \
-            self.alpha * (reward + self.gamma * self.maxQ_new)
+        target = reward + self.gamma * self.maxQ_new
+        if self.Qtable.batch_size > 1:
+            # Shared Q-table: written along with the other learners'
+            # updates, which then records the change in self.max_dQ
+            self.Qtable.stage(s, a, target, self.alpha, self)
+        else:
+            Q_old = self.Qtable.Q[s, a]
+            Q_new = (1.0 - self.alpha) * Q_old + self.alpha * target
+            self.Qtable.Q[s, a] = Q_new
+            self.max_dQ = max(self.max_dQ, abs(Q_new - Q_old))
+
+        # Replay past transitions along with this one, if enabled
+        if self.replay is not None:
+            self.replay.add(s, a, reward, s_prime)
+            if self.replay.due():
+                self.replay.update(self.Qtable, self.gamma, self.initial_alpha)
         
 
         # print "LearningAgent.update(): " + \
         # "deadline = {}, state = {}, ".format(deadline, self.state) + \
         # " action = {}, reward = {}".format(action, reward)  # [debug]
 
+def create_learners(env, n, enforce_deadline=True, optimism=5, **params):
+    '''
+    Creates n LearningAgents sharing one Q-table: the first one is the
+    primary agent, the others are added as learners with trips of their
+    own (see Environment.add_learner()).  Each step, the updates of all
+    n agents are written to the Q-table in one batch.
+    '''
+    qtable = QTable(optimism, batch_size=n)
+    learners = [env.create_agent(LearningAgent, optimism=optimism, qtable=qtable, **params) for i in xrange(n)]
+    env.set_primary_agent(learners[0], enforce_deadline=enforce_deadline)
+    for learner in learners[1:]:
+        env.add_learner(learner)
+    return learners
+
 def scatter(a, t):
     plt.plot(a, "o")
     plt.title(t)
@@ -306,8 +404,8 @@ def allScatter(a, N):
     w = 5
     plt.plot(success, "v", label="Trip Failed", color="green", markersize=2*m)
     
-    plt.plot(pd.rolling_mean(a.invalid, window=w), label="Rolling invalid mean", color = "blue")
-    plt.plot(pd.rolling_mean(a.wander, window=w), label="Rolling off-waypoint mean", color = "red")
+    plt.plot(pd.Series(a.invalid[:N]).rolling(window=w).mean(), label="Rolling invalid mean", color = "blue")
+    plt.plot(pd.Series(a.wander[:N]).rolling(window=w).mean(), label="Rolling off-waypoint mean", color = "red")
     
     sum_invalid = int(sum(a.invalid))
     sum_wander = int(sum(a.wander))
@@ -330,13 +428,16 @@ def run():
     """Run the agent for a finite number of trials."""
     
     # create environment (also adds some dummy traffic)
-    e = Environment()
+    e = Environment(sink=ConsoleSink())
+    # NOTE: Use ConsoleSink(level=DEBUG) to also print negative rewards,
+    # or events.CSVSink to log them to a file
     
     # create agent
     a = e.create_agent(LearningAgent)
     
     # specify agent to track
     e.set_primary_agent(a, enforce_deadline=True)
+    a.metrics = RollingMetrics(window=20)
     # NOTE: You can set enforce_deadline=False while debugging to
     # allow longer trials
     
@@ -344,6 +445,10 @@ def run():
     sim = Simulator(e, update_delay=0, display=False)
     # NOTE: To speed up simulation, reduce update_delay and/or set
     # display=False
+    def report(sim, trial):
+        if (trial + 1) % 25 == 0:
+            print "Trial {}: {}".format(trial + 1, a.metrics)
+    sim.callbacks.append(report)
     N = 100
     sim.run(n_trials=N)  # run for a specified number of trials
     # NOTE: To quit midway, press Esc or close pygame window, or hit
@@ -0,0 +1,247 @@
+import numpy as np
+
+from environment import Environment
+from planner import RoutePlanner, ShortestPathPlanner
+
+# Integer codes used by all batched arrays.
+# Actions and waypoints index into Environment.valid_actions,
+# headings index into Environment.valid_headings (ENWS).
+NONE, FORWARD, LEFT, RIGHT = range(len(Environment.valid_actions))
+RED, GREEN = 0, 1
+HEADINGS = np.array(Environment.valid_headings)
+
+
+class BatchEnvironment(object):
+    """Many independent copies of the smartcab world, stepped together.
+
+    Lights, locations, headings, waypoints and deadlines of every copy
+    are kept in NumPy arrays, so that one call to act() advances all
+    copies by one time step.  Each copy holds num_dummies DummyAgents
+    followed by a single primary agent, and follows the same rules as
+    Environment.step() and Environment.act().  The primary agent's next
+    waypoint comes from the waypoint table of planner_class.
+
+    Intersections are numbered in the order of Environment.locations;
+    self.coords maps those numbers back to (x, y) locations.
+    """
+
+    grid_size = (8, 6)  # (cols, rows)
+    bounds = (1, 1, grid_size[0], grid_size[1])
+    min_trip_dist = 4  # see Environment.reset()
+
+    def __init__(self, n_envs, num_dummies=3, enforce_deadline=True, seed=None, planner_class=ShortestPathPlanner):
+        self.n_envs = n_envs
+        self.num_dummies = num_dummies
+        self.n_agents = num_dummies + 1
+        self.primary = num_dummies  # primary agent is created last
+        self.enforce_deadline = enforce_deadline
+        self.rng = np.random.RandomState(seed)
+
+        # Road network: intersection coordinates, and the intersection
+        # reached by leaving each one along each heading (with wrap-around)
+        cols, rows = self.grid_size
+        self.coords = np.array(RoutePlanner.grid_locations(self.bounds))
+        n_locs = len(self.coords)
+        self.waypoint_table = planner_class.waypoint_table(self.bounds)
+        ahead = (self.coords[:, None, :] + HEADINGS[None, :, :] - self.bounds[:2]) % self.grid_size
+        self.neighbors = ahead[..., 0] * rows + ahead[..., 1]
+
+        # Traffic lights, indexed by [env, intersection].  A light flips at
+        # every multiple of its period within a trip, so its state is only
+        # computed when it is read, from the state it had at the start of
+        # the trip and the time of the last light update (self.light_t).
+        self.light_state = self.rng.randint(0, 2, size=(n_envs, n_locs)).astype(bool)  # True = NS open
+        self.light_period = self.rng.choice([3, 4, 5], size=(n_envs, n_locs))
+        self.light_t = np.zeros(n_envs, dtype=int)
+
+        # Agent state, indexed by [env, agent]
+        self.loc = np.zeros((n_envs, self.n_agents), dtype=int)
+        self.heading = np.zeros((n_envs, self.n_agents), dtype=int)
+        self.waypoint = np.zeros((n_envs, self.n_agents), dtype=int)
+        self.waypoint[:, :self.primary] = self.random_waypoints((n_envs, num_dummies))
+
+        # Per-trip state, indexed by [env]
+        self.destination = np.zeros(n_envs, dtype=int)
+        self.deadline = np.zeros(n_envs, dtype=int)
+        self.t = np.zeros(n_envs, dtype=int)
+        self.done = np.ones(n_envs, dtype=bool)
+        self.pending = np.zeros(n_envs, dtype=bool)  # copies waiting for lights and dummies to update
+        self._rows = np.arange(n_envs)
+
+    @property
+    def location(self):
+        """(x, y) location of every agent, indexed by [env, agent]."""
+        return self.coords[self.loc]
+
+    def reset(self, mask=None, start=None, heading=None, destination=None):
+        """Start a new trip in every copy selected by mask (default: all).
+
+        start, heading and destination, if given, are arrays with one
+        value per selected copy (as intersection and heading numbers),
+        overriding the random trips.
+        """
+        mask = np.ones(self.n_envs, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        idx = np.flatnonzero(mask)
+        n = len(idx)
+        if n == 0:
+            return
+
+        self.done[idx] = False
+        self.t[idx] = 0
+
+        # Carry the lights over from the previous trip
+        self.light_state[idx] ^= (self.light_t[idx, None] // self.light_period[idx]) % 2 == 1
+        self.light_t[idx] = 0
+
+        # Pick a start and a destination, not too close to each other
+        if start is None or destination is None:
+            start = self.random_locations(n)
+            destination = self.random_locations(n)
+            close = self.compute_dist(start, destination) < self.min_trip_dist
+            while close.any():
+                start[close] = self.random_locations(close.sum())
+                destination[close] = self.random_locations(close.sum())
+                close = self.compute_dist(start, destination) < self.min_trip_dist
+
+        self.destination[idx] = destination
+        self.deadline[idx] = self.compute_dist(start, destination) * 5
+
+        # Initialize agents
+        self.loc[idx, :self.primary] = self.random_locations((n, self.num_dummies))
+        self.heading[idx, :self.primary] = self.rng.randint(0, 4, size=(n, self.num_dummies))
+        self.loc[idx, self.primary] = start
+        self.heading[idx, self.primary] = heading if heading is not None else self.rng.randint(0, 4, size=n)
+        self._update_waypoint(idx)
+
+        self.pending |= mask
+
+    def sense(self):
+        """Inputs of every primary agent, as integer-coded arrays."""
+        self._begin_step()
+        return self._sense(self.primary)
+
+    def get_next_waypoint(self):
+        return self.waypoint[:, self.primary]
+
+    def get_deadline(self):
+        return self.deadline
+
+    def act(self, actions):
+        """Apply one action per copy to its primary agent.
+
+        Copies which are already done are left untouched and receive a
+        reward of 0.  Returns the array of rewards; self.done tells which
+        trips ended on this step.
+        """
+        self._begin_step()
+        actions = np.asarray(actions)
+        active = ~self.done
+        p = self.primary
+
+        waypoint = self.waypoint[:, p]
+        move_okay = self._move(p, actions, active)
+        reward = np.where(~move_okay, -1.0,
+                 np.where(actions == NONE, 0.0,
+                 np.where(actions == waypoint, 2.0, -0.5)))
+
+        # Primary agent has reached destination
+        reached = active & (self.loc[:, p] == self.destination)
+        reward[reached & (self.deadline >= 0)] += 10
+        reward[~active] = 0.0
+
+        # Deadline bookkeeping, as in Environment.step()
+        active &= ~reached
+        timed_out = self.deadline <= Environment.hard_time_limit
+        if self.enforce_deadline:
+            timed_out |= self.deadline <= 0
+        timed_out &= active
+        self.deadline[active] -= 1
+        self.t[active] += 1
+        self.done |= reached | timed_out
+
+        # Next waypoint of the primary agent, as LearningAgent.get_state()
+        # would compute it after acting
+        self._update_waypoint(np.flatnonzero(active))
+
+        self.pending = active & ~timed_out
+        return reward
+
+    def _begin_step(self):
+        """Update lights and dummy agents of the pending copies, up to the
+        primary agent's turn."""
+        active = self.pending
+        if not active.any():
+            return
+        self.pending = np.zeros(self.n_envs, dtype=bool)
+
+        # Update traffic lights
+        self.light_t = np.where(active, self.t, self.light_t)
+
+        # Update dummy agents, in creation order.  A dummy's own right-of-way
+        # check matches the rules in _move(), so it moves exactly when its
+        # waypoint is a valid action, and then picks a new waypoint.
+        for i in xrange(self.num_dummies):
+            moved = self._move(i, self.waypoint[:, i], active) & active
+            self.waypoint[:, i] = np.where(moved, self.random_waypoints(self.n_envs), self.waypoint[:, i])
+
+    def _update_waypoint(self, idx):
+        p = self.primary
+        self.waypoint[idx, p] = self.waypoint_table[self.destination[idx], self.loc[idx, p], self.heading[idx, p]]
+
+    def _sense(self, i):
+        """Environment.sense() for agent i of every copy."""
+        here = self.loc == self.loc[:, i:i + 1]
+        relative = (self.heading - self.heading[:, i:i + 1]) % 4  # 0: same heading, 1: from the right, 2: oncoming, 3: from the left
+
+        oncoming = np.full(self.n_envs, NONE, dtype=int)
+        left = np.full(self.n_envs, NONE, dtype=int)
+        right = np.full(self.n_envs, NONE, dtype=int)
+        for j in xrange(self.n_agents):
+            if j == i:
+                continue
+            other_heading = self.waypoint[:, j]
+            present = here[:, j]
+            mask = present & (relative[:, j] == 2) & (oncoming != LEFT)  # we don't want to override oncoming == 'left'
+            oncoming = np.where(mask, other_heading, oncoming)
+            mask = present & (relative[:, j] == 1) & (right != FORWARD) & (right != LEFT)  # we don't want to override right == 'forward or 'left'
+            right = np.where(mask, other_heading, right)
+            mask = present & (relative[:, j] == 3) & (left != FORWARD)  # we don't want to override left == 'forward'
+            left = np.where(mask, other_heading, left)
+
+        loc = self.loc[:, i]
+        ns_open = self.light_state[self._rows, loc] ^ ((self.light_t // self.light_period[self._rows, loc]) % 2 == 1)
+        vertical = self.heading[:, i] % 2 == 1  # N or S
+        light = np.where(ns_open == vertical, GREEN, RED)
+
+        return {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
+
+    def _move(self, i, action, active):
+        """Move agent i of every active copy if it obeys traffic rules.
+
+        Returns the boolean array of valid (possibly null) moves.
+        """
+        inputs = self._sense(i)
+        green = inputs['light'] == GREEN
+        heading = self.heading[:, i]
+
+        move_okay = np.where(action == FORWARD, green,
+                    np.where(action == LEFT, green & ((inputs['oncoming'] == NONE) | (inputs['oncoming'] == LEFT)),
+                    np.where(action == RIGHT, green | (inputs['left'] != FORWARD), True)))
+        heading = np.where(action == LEFT, (heading + 1) % 4,
+                  np.where(action == RIGHT, (heading + 3) % 4, heading))
+
+        moving = move_okay & (action != NONE) & active
+        self.loc[:, i] = np.where(moving, self.neighbors[self.loc[:, i], heading], self.loc[:, i])  # wrap-around
+        self.heading[:, i] = np.where(moving, heading, self.heading[:, i])
+        return move_okay
+
+    def random_locations(self, shape):
+        return self.rng.randint(0, len(self.coords), size=shape)
+
+    def random_waypoints(self, shape):
+        return self.rng.randint(FORWARD, RIGHT + 1, size=shape)
+
+    def compute_dist(self, a, b):
+        """Environment.compute_wrap_dist() between two arrays of intersections."""
+        delta = np.abs(self.coords[b] - self.coords[a])
+        return np.minimum(delta, self.grid_size - delta).sum(axis=-1)
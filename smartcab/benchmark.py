@@ -0,0 +1,181 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import timeit
+
+import numpy as np
+
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+
+clock = timeit.default_timer
+percentiles = (50, 90, 99)
+
+
+class Timed(object):
+    """Wraps a callable, recording the duration of every call."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.durations = []
+
+    def __call__(self, *args, **kwargs):
+        start = clock()
+        result = self.fn(*args, **kwargs)
+        self.durations.append(clock() - start)
+        return result
+
+    def summary(self):
+        """Call count and latency percentiles, in microseconds."""
+        stats = {'calls': len(self.durations)}
+        if self.durations:
+            for p, value in zip(percentiles, np.percentile(self.durations, percentiles)):
+                stats['p{}_us'.format(p)] = 1e6 * value
+        return stats
+
+
+def max_rss_mb():
+    """Peak resident memory of this process so far, in MB (Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _measured(job):
+    fn, args = job
+    start = max_rss_mb()
+    result = fn(*args)
+    result['max_rss_mb'] = max_rss_mb()
+    result['rss_growth_mb'] = result['max_rss_mb'] - start  # memory used by this config alone
+    return result
+
+
+def run_isolated(fn, *args):
+    """fn(*args) in a fresh worker process, so that its peak memory is its
+    own: adds max_rss_mb and rss_growth_mb (growth of the peak during
+    the call) to the dict it returns."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_measured, ((fn, args),))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def bench_step(grid_size=(8, 6), num_dummies=3, n_steps=500, seed=0):
+    """Step rate, and latency of the main calls made during a step.
+
+    Run it through run_isolated() to also measure its memory use.  A
+    LearningAgent drives as the primary agent; sense(), act(), its
+    planner's next_waypoint() and its update() are timed call by call.
+    """
+    env = Environment(num_dummies=num_dummies, grid_size=grid_size, seed=seed)
+    agent = env.create_agent(LearningAgent)
+    env.set_primary_agent(agent, enforce_deadline=False)
+
+    # Instance attributes shadow the methods, so every caller is timed
+    timers = {
+        'sense': Timed(env.sense),
+        'act': Timed(env.act),
+        'next_waypoint': Timed(agent.planner.next_waypoint),
+        'update': Timed(agent.update),
+    }
+    env.sense = timers['sense']
+    env.act = timers['act']
+    agent.planner.next_waypoint = timers['next_waypoint']
+    agent.update = timers['update']
+
+    step_time = 0.0
+    env.reset()
+    for _ in xrange(n_steps):
+        if env.done:
+            env.reset()
+        start = clock()
+        env.step()
+        step_time += clock() - start
+
+    result = {'grid_size': list(grid_size), 'num_dummies': num_dummies, 'steps': n_steps,
+              'steps_per_sec': n_steps / step_time}
+    for name, timer in timers.iteritems():
+        result[name] = timer.summary()
+    return result
+
+
+def bench_convergence(max_trials=300, window=10, target=0.9, seed=0, **params):
+    """Trials until a LearningAgent makes clean trips at the target rate.
+
+    A trip is clean if it reaches the destination without an invalid
+    move; the default agent reaches its destination almost from the
+    first trial, so the success rate alone tells nothing.  trials is the
+    number of trials until the rate of clean trips over the last window
+    first reaches target (None if it never does within max_trials); it
+    cannot be below floor (= window).  invalid_moves counts all the
+    invalid moves of the run.
+    """
+    env = Environment(seed=seed)
+    agent = env.create_agent(LearningAgent, n_trials=max_trials, **params)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    sim = Simulator(env, update_delay=0, display=False)
+    start = clock()
+    sim.run(n_trials=max_trials)
+    elapsed = clock() - start
+
+    success, invalid = agent.success[:max_trials], agent.invalid[:max_trials]
+    clean = (success > 0) & (invalid == 0)
+    rate = np.convolve(clean, np.ones(window) / window, mode='valid')
+    reached = np.flatnonzero(rate >= target)
+    trials = int(reached[0]) + window if len(reached) else None
+    return {'max_trials': max_trials, 'window': window, 'target': target, 'floor': window, 'seed': seed,
+            'params': params, 'trials': trials, 'success_rate': success.mean(), 'invalid_moves': int(invalid.sum()),
+            'secs': elapsed}
+
+
+def bench_num_dummies(counts=(3, 10, 30, 100, 300, 1000), n_steps=200):
+    """Time Environment.step() as the number of dummy agents grows.
+
+    With the occupancy index, sense() only looks at agents sharing an
+    intersection, so the cost per agent should stay roughly flat.
+    """
+    print "num_dummies, ms/step, us/agent-step"
+    for num_dummies in counts:
+        env = Environment(num_dummies=num_dummies)
+        env.reset()
+        start = clock()
+        for _ in xrange(n_steps):
+            env.step()
+        elapsed = clock() - start
+        print "{}, {:.3f}, {:.2f}".format(num_dummies, 1e3 * elapsed / n_steps, 1e6 * elapsed / (n_steps * num_dummies))
+
+
+def run_benchmarks(grid_sizes=((8, 6), (32, 24), (64, 64)), dummy_counts=(3, 30, 300), n_steps=500, seeds=(0, 1, 2)):
+    """Run the step benchmark matrix and the convergence benchmark.
+
+    Each step benchmark runs in its own process.  The default grids stay
+    within RoutePlanner.max_table_size, so they time the table lookups
+    of the planner rather than its fallback for larger grids.
+    """
+    results = {'step': [], 'convergence': []}
+    for grid_size in grid_sizes:
+        for num_dummies in dummy_counts:
+            result = run_isolated(bench_step, grid_size, num_dummies, n_steps)
+            print "step: grid {}, {} dummies: {:.0f} steps/sec, {:.1f} MB".format(grid_size, num_dummies, result['steps_per_sec'], result['rss_growth_mb'])
+            results['step'].append(result)
+    for seed in seeds:
+        result = bench_convergence(seed=seed)
+        print "convergence: seed {}: {} trials (floor {}), {} invalid moves".format(seed, result['trials'], result['floor'], result['invalid_moves'])
+        results['convergence'].append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the smartcab simulator.")
+    parser.add_argument('--output', default='benchmark.json', help="file to write results to, as JSON")
+    parser.add_argument('--quick', action='store_true', help="small matrix, for a smoke test")
+    args = parser.parse_args()
+
+    if args.quick:
+        results = run_benchmarks(grid_sizes=((8, 6),), dummy_counts=(3, 30), n_steps=200, seeds=(0,))
+    else:
+        results = run_benchmarks()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,98 @@
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from environment import Environment
+
+
+def snapshot(agent):
+    """Copy of the learning state of a LearningAgent, as arrays.
+
+    Holds the Q-table, visit counts, per-trial statistics, trial
+    counters and the state of the environment's random generator, and
+    the traffic state carried over between trials (switch counts of the
+    lights, waypoints of the other agents), so that a seeded run resumes
+    exactly where it stopped.
+    """
+    env = agent.env
+    rng_state = pickle.dumps(env.rng.getstate(), pickle.HIGHEST_PROTOCOL)
+    periods = sorted(env.light_clock.flips)
+    return {
+        'Q': agent.Qtable.Q.copy(),
+        'visits': agent.Qtable.visits.copy(),
+        'success': agent.success.copy(),
+        'invalid': agent.invalid.copy(),
+        'wander': agent.wander.copy(),
+        'trial': np.array(agent.trial),
+        'trips_failed': np.array(agent.trips_failed),
+        'env_trial': np.array(agent.env.trial),
+        'rng_state': np.frombuffer(rng_state, dtype=np.uint8),
+        'light_periods': np.array(periods),
+        'light_flips': np.array([env.light_clock.flips[period] + env.light_clock.t // period for period in periods]),
+        'waypoints': np.array([Environment.valid_actions.index(other.get_next_waypoint()) for other in env.agent_states]),
+    }
+
+
+def write_checkpoint(arrays, path):
+    """Write a snapshot() to path, atomically (via a temporary file)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp_path, path)
+
+
+def save_checkpoint(agent, path):
+    write_checkpoint(snapshot(agent), path)
+
+
+def load_checkpoint(agent, path):
+    """Restore the learning state of a LearningAgent saved at path."""
+    with np.load(path) as checkpoint:
+        agent.Qtable.Q[...] = checkpoint['Q']
+        agent.Qtable.visits[...] = checkpoint['visits']
+        agent.success = checkpoint['success'].copy()
+        agent.invalid = checkpoint['invalid'].copy()
+        agent.wander = checkpoint['wander'].copy()
+        agent.N = len(agent.success)
+        agent.trial = int(checkpoint['trial'])
+        agent.trips_failed = int(checkpoint['trips_failed'])
+        env = agent.env
+        env.trial = int(checkpoint['env_trial'])
+        env.rng.setstate(pickle.loads(checkpoint['rng_state'].tostring()))
+        env.light_clock.t = 0
+        env.light_clock.flips.update(zip(checkpoint['light_periods'].tolist(), checkpoint['light_flips'].tolist()))
+        for other, waypoint in zip(env.agent_states, checkpoint['waypoints']):
+            other.next_waypoint = Environment.valid_actions[waypoint]
+
+
+class Checkpointer(object):
+    """Simulator callback saving a LearningAgent every `every` trials.
+
+    The learning state is copied between trials, which only takes a
+    few small array copies, and written to disk by a background thread
+    so the simulation does not wait on I/O.  Call close() after the run
+    to wait for the last write.
+    """
+
+    def __init__(self, agent, path, every=100):
+        self.agent = agent
+        self.path = path
+        self.every = every
+        self.writer = None
+
+    def __call__(self, sim, trial):
+        if (self.agent.env.trial + 1) % self.every == 0:
+            self.save()
+
+    def save(self):
+        arrays = snapshot(self.agent)
+        self.close()  # one write at a time
+        self.writer = threading.Thread(target=write_checkpoint, args=(arrays, self.path))
+        self.writer.start()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
@@ -3,24 +3,88 @@ import random
 from collections import OrderedDict
 
 from simulator import Simulator
+from events import EventSink, INFO, WARNING
+from profiling import PhaseStats
+from traffic import TrafficController
+
+class LightClock(object):
+    """Time base shared by traffic lights.
+
+    Within a trial, a light switches at every multiple of its period, so
+    after an update at time t it has switched t // period times.  The
+    clock remembers t, and how many times lights of each period switched
+    in earlier trials, which is all a light needs to compute its state.
+    """
+
+    def __init__(self):
+        self.t = 0  # time of the last update in this trial
+        self.flips = {}  # period -> no. of switches in earlier trials
+
+    def add_period(self, period):
+        self.flips.setdefault(period, 0)
+
+    def reset(self):
+        for period in self.flips:
+            self.flips[period] += self.t // period
+        self.t = 0
+
+    def update(self, t):
+        self.t = t
+
 
 class TrafficLight(object):
-    """A traffic light that switches periodically."""
+    """A traffic light that switches periodically.
 
+    The state is computed from the initial state, the period and a
+    LightClock when read, so updating the clock updates every light
+    sharing it at once.
+    """
+
+    __slots__ = ('initial_state', 'period', 'clock')  # one per intersection, keep them small
     valid_states = [True, False]  # True = NS open, False = EW open
 
-    def __init__(self, state=None, period=None):
-        self.state = state if state is not None else random.choice(self.valid_states)
-        self.period = period if period is not None else random.choice([3, 4, 5])
-        self.last_updated = 0
+    def __init__(self, state=None, period=None, rng=random, periods=(3, 4, 5), clock=None):
+        self.initial_state = state if state is not None else rng.choice(self.valid_states)
+        self.period = period if period is not None else rng.choice(periods)
+        self.clock = clock if clock is not None else LightClock()
+        self.clock.add_period(self.period)
+
+    @property
+    def state(self):
+        clock = self.clock
+        return self.initial_state != ((clock.flips[self.period] + clock.t // self.period) % 2 == 1)
 
     def reset(self):
-        self.last_updated = 0
+        self.clock.reset()
 
     def update(self, t):
-        if t - self.last_updated >= self.period:
-            self.state = not self.state  # assuming state is boolean
-            self.last_updated = t
+        self.clock.update(t)
+
+
+class AgentState(object):
+    """Location, heading, destination and deadline of an agent.
+
+    One record per agent, created by Environment.create_agent() and
+    updated in place from then on, by the Environment only, which keeps
+    its index of agents by intersection and the sense() cache in step
+    with it (see add_occupant()).  Fields are attributes; they can also
+    be read in the state['location'] style of the former per-agent dicts.
+    """
+
+    __slots__ = ('location', 'heading', 'destination', 'deadline')
+
+    def __init__(self, location=None, heading=None, destination=None, deadline=None):
+        self.location = location
+        self.heading = heading
+        self.destination = destination
+        self.deadline = deadline
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "AgentState(location={}, heading={}, destination={}, deadline={})".format(
+            self.location, self.heading, self.destination, self.deadline)
 
 
 class Environment(object):
@@ -31,145 +95,276 @@ class Environment(object):
     valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # ENWS
     hard_time_limit = -100  # even if enforce_deadline is False, end trial when deadline reaches this value (to avoid deadlocks)
 
-    def __init__(self, num_dummies=3):
+    def __init__(self, num_dummies=3, sink=None, seed=None, grid_size=(8, 6), block_size=100, light_periods=(3, 4, 5), vectorized_traffic=False):
         self.num_dummies = num_dummies  # no. of dummy agents
+        self.sink = sink if sink is not None else EventSink()  # trial lifecycle events (see events.py)
+
+        # Random generator shared by the environment, its traffic lights
+        # and its agents; when seeded, it is reseeded at each reset() from
+        # (seed, trial), so a trial only depends on the seed, its number
+        # and the state of the agents
+        self.seed = seed
+        self.rng = random.Random(seed)
         
         # Initialize simulation variables
         self.done = False
         self.t = 0
-        self.agent_states = OrderedDict()
-        self.status_text = ""
+        self.trial = -1  # no. of the current trial
+        self.agent_states = OrderedDict()  # agent -> AgentState
+        self.agent_ids = {}  # agent -> creation order
+        self.occupants = {}  # intersection -> agents located there, in creation order
+        self.sense_cache = {}  # intersection -> {heading: sense() inputs}, for the current tick
+        self.status = None  # (action, reward) of the primary agent's last move
+        self.stats = None  # PhaseStats, when profiling (see enable_profiling())
 
         # Road network
-        self.grid_size = (8, 6)  # (cols, rows)
+        self.grid_size = tuple(grid_size)  # (cols, rows)
         self.bounds = (1, 1, self.grid_size[0], self.grid_size[1])
-        self.block_size = 100
-        self.intersections = OrderedDict()
+        self.block_size = block_size
+        self.light_periods = light_periods
+        self.light_clock = LightClock()
+        self.locations = []  # intersections, by column then row
+        self.intersections = {}
         self.roads = []
         for x in xrange(self.bounds[0], self.bounds[2] + 1):
             for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                self.intersections[(x, y)] = TrafficLight()  # a traffic light at each intersection
+                self.locations.append((x, y))
+                self.intersections[(x, y)] = TrafficLight(rng=self.rng, periods=light_periods, clock=self.light_clock)  # a traffic light at each intersection
 
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
+        for a in self.locations:
+            for b in ((a[0] - 1, a[1]), (a[0], a[1] - 1), (a[0], a[1] + 1), (a[0] + 1, a[1])):  # L1 distance = 1
+                if b in self.intersections:
                     self.roads.append((a, b))
 
-        # Dummy agents
-        for i in xrange(self.num_dummies):
-            self.create_agent(DummyAgent)
+        # Trips start at least this far from their destination
+        self.min_trip_dist = min(4, self.grid_size[0] // 2 + self.grid_size[1] // 2)
+
+        # Dummy agents, moved together by a TrafficController if
+        # vectorized_traffic (with the same outcome), else one by one by
+        # DummyAgent.update()
+        dummies = [self.create_agent(DummyAgent) for i in xrange(self.num_dummies)]
+        self.traffic = TrafficController(self, dummies) if vectorized_traffic else None
 
         # Primary agent and associated parameters
         self.primary_agent = None  # to be set explicitly
         self.enforce_deadline = False
+        self.learners = []  # other agents with trips of their own, see add_learner()
 
     def create_agent(self, agent_class, *args, **kwargs):
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': random.choice(self.intersections.keys()), 'heading': (0, 1)}
+        self.agent_ids[agent] = len(self.agent_ids)
+        self.agent_states[agent] = AgentState(self.rng.choice(self.locations), (0, 1))
+        self.add_occupant(agent, self.agent_states[agent].location)
+        if self.stats is not None:
+            self.stats.attach(agent, 'update', 'update:' + agent_class.__name__)
         return agent
 
+    def enable_profiling(self, stats=None):
+        """Time reset(), step() and its phases: lights, the update() of
+        each agent class, sense() and act().  Returns the PhaseStats collecting them."""
+        if self.stats is not None:
+            return self.stats
+        self.stats = stats if stats is not None else PhaseStats()
+        self.stats.attach(self, 'step', 'step')
+        self.stats.attach(self, 'reset', 'reset')
+        self.stats.attach(self.light_clock, 'update', 'lights')
+        self.stats.attach(self, 'sense', 'sense')
+        self.stats.attach(self, 'act', 'act')
+        if self.traffic is not None:
+            self.stats.attach(self.traffic, 'update', 'traffic')
+        for agent in self.agent_states:
+            self.stats.attach(agent, 'update', 'update:' + agent.__class__.__name__)
+        return self.stats
+
+    def disable_profiling(self):
+        if self.stats is not None:
+            self.stats.detach()
+            self.stats = None
+
     def set_primary_agent(self, agent, enforce_deadline=False):
         self.primary_agent = agent
         self.enforce_deadline = enforce_deadline
 
+    def add_learner(self, agent):
+        """Give agent trips of its own, like the primary agent's: a
+        destination and a deadline, and a reward bonus on arrival.  Its
+        next trip starts where the previous one ended, or timed out
+        (under the primary agent's enforce_deadline); only the primary
+        agent's trips end a trial."""
+        self.learners.append(agent)
+
+    def start_trip(self, agent):
+        """New destination and deadline for a learner, from where it is."""
+        state = self.agent_states[agent]
+        destination = self.rng.choice(self.locations)
+        while self.compute_wrap_dist(state.location, destination) < self.min_trip_dist:
+            destination = self.rng.choice(self.locations)
+        state.destination = destination
+        state.deadline = self.compute_wrap_dist(state.location, destination) * 5
+        agent.reset(destination=destination)
+
     def reset(self):
         self.done = False
         self.t = 0
+        self.trial += 1
+        if self.seed is not None:
+            self.rng.seed(self.trial_seed(self.trial))
 
         # Reset traffic lights
-        for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
+        self.light_clock.reset()
+        self.sense_cache.clear()
 
         # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
+        start = self.rng.choice(self.locations)
+        destination = self.rng.choice(self.locations)
 
         # Ensure starting location and destination are not too close
-        while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
-
-        start_heading = random.choice(self.valid_headings)
-        deadline = self.compute_dist(start, destination) * 5
-        print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
-
-        # Initialize agent(s)
-        for agent in self.agent_states.iterkeys():
-            self.agent_states[agent] = {
-                'location': start if agent is self.primary_agent else random.choice(self.intersections.keys()),
-                'heading': start_heading if agent is self.primary_agent else random.choice(self.valid_headings),
-                'destination': destination if agent is self.primary_agent else None,
-                'deadline': deadline if agent is self.primary_agent else None}
+        while self.compute_wrap_dist(start, destination) < self.min_trip_dist:
+            start = self.rng.choice(self.locations)
+            destination = self.rng.choice(self.locations)
+
+        start_heading = self.rng.choice(self.valid_headings)
+        deadline = self.compute_wrap_dist(start, destination) * 5
+        if self.sink.level <= INFO:
+            self.sink.emit(INFO, 'reset', start, destination, deadline)
+
+        # Initialize agent(s), updating their records in place
+        self.occupants.clear()
+        for agent, state in self.agent_states.iteritems():
+            if agent is self.primary_agent:
+                state.location = start
+                state.heading = start_heading
+                state.destination = destination
+                state.deadline = deadline
+            else:
+                state.location = self.rng.choice(self.locations)
+                state.heading = self.rng.choice(self.valid_headings)
+                state.destination = None
+                state.deadline = None
+            self.add_occupant(agent, state.location)
             agent.reset(destination=(destination if agent is self.primary_agent else None))
+        for agent in self.learners:
+            self.start_trip(agent)
+        if self.traffic is not None:
+            self.traffic.reset()
+
+    def trial_seed(self, trial):
+        """Seed of the random generator for a trial, derived from self.seed."""
+        return (self.seed * 1000003 + trial) & 0xffffffff
 
     def step(self):
         #print "Environment.step(): t = {}".format(self.t)  # [debug]
 
         # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        self.light_clock.update(self.t)
+        self.sense_cache.clear()
 
         # Update agents
-        for agent in self.agent_states.iterkeys():
+        if self.traffic is None:
+            agents = self.agent_states.iterkeys()
+        else:
+            self.traffic.update(self.t)
+            agents = self.traffic.others
+        for agent in agents:
             agent.update(self.t)
 
         if self.done:
             return  # primary agent might have reached destination
 
         if self.primary_agent is not None:
-            agent_deadline = self.agent_states[self.primary_agent]['deadline']
+            state = self.agent_states[self.primary_agent]
+            agent_deadline = state.deadline
             if agent_deadline <= self.hard_time_limit:
                 self.done = True
-                print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
+                if self.sink.level <= WARNING:
+                    self.sink.emit(WARNING, 'hard_time_limit', self.hard_time_limit)
             elif self.enforce_deadline and agent_deadline <= 0:
                 self.done = True
-                print "Environment.step(): Primary agent ran out of time! Trial aborted."
-            self.agent_states[self.primary_agent]['deadline'] = agent_deadline - 1
+                if self.sink.level <= INFO:
+                    self.sink.emit(INFO, 'out_of_time')
+            state.deadline = agent_deadline - 1
+
+        for agent in self.learners:
+            state = self.agent_states[agent]
+            if state.deadline <= self.hard_time_limit or (self.enforce_deadline and state.deadline <= 0):
+                self.start_trip(agent)
+            else:
+                state.deadline -= 1
 
         self.t += 1
 
     def sense(self, agent):
+        """Inputs of agent: light, and next waypoints of the traffic.
+
+        They only depend on the agent's location and heading, so they are
+        cached per (location, heading) until lights update or an agent
+        moves into or out of the location (see invalidate()); the
+        returned dict is shared, and must not be modified.
+        """
         assert agent in self.agent_states, "Unknown agent!"
 
         state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        location = state.location
+        heading = state.heading
+        cached = self.sense_cache.get(location)
+        if cached is None:
+            cached = self.sense_cache[location] = {}
+        else:
+            inputs = cached.get(heading)
+            if inputs is not None:
+                return inputs
+
+        ns_open = self.intersections[location].state
+        light = 'green' if (ns_open and heading[1] != 0) or ((not ns_open) and heading[0] != 0) else 'red'
 
         # Populate oncoming, left, right
         oncoming = None
         left = None
         right = None
-        for other_agent, other_state in self.agent_states.iteritems():
-            if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+        for other_agent in self.occupants[location]:
+            other_state_heading = self.agent_states[other_agent].heading
+            if agent == other_agent or (heading[0] == other_state_heading[0] and heading[1] == other_state_heading[1]):
                 continue
             other_heading = other_agent.get_next_waypoint()
-            if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
+            if (heading[0] * other_state_heading[0] + heading[1] * other_state_heading[1]) == -1:
                 if oncoming != 'left':  # we don't want to override oncoming == 'left'
                     oncoming = other_heading
-            elif (heading[1] == other_state['heading'][0] and -heading[0] == other_state['heading'][1]):
+            elif (heading[1] == other_state_heading[0] and -heading[0] == other_state_heading[1]):
                 if right != 'forward' and right != 'left':  # we don't want to override right == 'forward or 'left'
                     right = other_heading
             else:
                 if left != 'forward':  # we don't want to override left == 'forward'
                     left = other_heading
 
-        return {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
+        inputs = cached[heading] = {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
+        return inputs
+
+    def invalidate(self, location):
+        """Drop the cached sense() inputs at location, e.g. when the next
+        waypoint of an agent there changes."""
+        self.sense_cache.pop(location, None)
+
+    def get_location(self, agent):
+        return self.agent_states[agent].location
+
+    def get_heading(self, agent):
+        return self.agent_states[agent].heading
+
+    def get_destination(self, agent):
+        return self.agent_states[agent].destination
 
     def get_deadline(self, agent):
-        return self.agent_states[agent]['deadline'] if agent is self.primary_agent else None
+        return self.agent_states[agent].deadline  # None for agents without trips
 
     def act(self, agent, action):
         assert agent in self.agent_states, "Unknown agent!"
         assert action in self.valid_actions, "Invalid action!"
 
         state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        location = state.location
+        heading = state.heading
         inputs = self.sense(agent)
+        light = inputs['light']
 
         # Move agent if within bounds and obeys traffic rules
         reward = 0  # reward/penalty
@@ -195,8 +390,10 @@ class Environment(object):
                 location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
                             (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
                 #if self.bounds[0] <= location[0] <= self.bounds[2] and self.bounds[1] <= location[1] <= self.bounds[3]:  # bounded
-                state['location'] = location
-                state['heading'] = heading
+                self.remove_occupant(agent, state.location)
+                self.add_occupant(agent, location)
+                state.location = location
+                state.heading = heading
                 reward = 2.0 if action == agent.get_next_waypoint() else -0.5  # valid, but is it correct? (as per waypoint)
             else:
                 # Valid null move
@@ -206,26 +403,62 @@ class Environment(object):
             reward = -1.0
 
         if agent is self.primary_agent:
-            if state['location'] == state['destination']:
-                if state['deadline'] >= 0:
+            if state.location == state.destination:
+                if state.deadline >= 0:
                     reward += 10  # bonus
                 self.done = True
-                print "Environment.act(): Primary agent has reached destination!"  # [debug]
-            self.status_text = "state: {}\naction: {}\nreward: {}".format(agent.get_state(), action, reward)
+                if self.sink.level <= INFO:
+                    self.sink.emit(INFO, 'arrived')
+            self.status = (action, reward)
             #print "Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, action, reward)  # [debug]
+        elif state.destination is not None and state.location == state.destination:  # a learner's trip
+            if state.deadline >= 0:
+                reward += 10  # bonus
+            self.start_trip(agent)
 
         return reward
 
+    @property
+    def status_text(self):
+        """Primary agent's state, last action and reward, for display."""
+        if self.status is None:
+            return ""
+        action, reward = self.status
+        return "state: {}\naction: {}\nreward: {}".format(self.primary_agent.get_state(), action, reward)
+
+    def add_occupant(self, agent, location):
+        """Index agent as being at location; sense() relies on this."""
+        self.sense_cache.pop(location, None)
+        occupants = self.occupants.setdefault(location, [])
+        occupants.append(agent)
+        if len(occupants) > 1:
+            occupants.sort(key=self.agent_ids.get)  # sense() depends on agent order
+
+    def remove_occupant(self, agent, location):
+        self.sense_cache.pop(location, None)
+        occupants = self.occupants[location]
+        occupants.remove(agent)
+        if not occupants:
+            del self.occupants[location]
+
     def compute_dist(self, a, b):
         """L1 distance between two points."""
         return abs(b[0] - a[0]) + abs(b[1] - a[1])
 
+    def compute_wrap_dist(self, a, b):
+        """L1 distance between two points, going around the edges of the
+        grid where shorter (as agents do in act())."""
+        dx = abs(b[0] - a[0])
+        dy = abs(b[1] - a[1])
+        return min(dx, self.grid_size[0] - dx) + min(dy, self.grid_size[1] - dy)
+
 
 class Agent(object):
     """Base class for all agents."""
 
     def __init__(self, env):
         self.env = env
+        self.rng = env.rng  # random generator, may be replaced per agent
         self.state = None
         self.next_waypoint = None
         self.color = 'cyan'
@@ -248,8 +481,8 @@ class DummyAgent(Agent):
 
     def __init__(self, env):
         super(DummyAgent, self).__init__(env)  # sets self.env = env, state = None, next_waypoint = None, and a default color
-        self.next_waypoint = random.choice(Environment.valid_actions[1:])
-        self.color = random.choice(self.color_choices)
+        self.next_waypoint = self.rng.choice(Environment.valid_actions[1:])
+        self.color = self.rng.choice(self.color_choices)
 
     def update(self, t):
         inputs = self.env.sense(self)
@@ -268,7 +501,7 @@ class DummyAgent(Agent):
         action = None
         if action_okay:
             action = self.next_waypoint
-            self.next_waypoint = random.choice(Environment.valid_actions[1:])
+            self.next_waypoint = self.rng.choice(Environment.valid_actions[1:])
         reward = self.env.act(self, action)
         #print "DummyAgent.update(): t = {}, inputs = {}, action = {}, reward = {}".format(t, inputs, action, reward)  # [debug]
         #print "DummyAgent.update(): next_waypoint = {}".format(self.next_waypoint)  # [debug]
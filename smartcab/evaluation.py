@@ -0,0 +1,58 @@
+import numpy as np
+
+from batch import BatchEnvironment
+from qtable import QTable
+
+
+def all_trips(env):
+    """Every (start, heading, destination) a trip of env can have.
+
+    Returns three arrays of intersection and heading numbers: the trips
+    Environment.reset() may pick, i.e. with the start and destination at
+    least env.min_trip_dist apart.
+    """
+    n_locs = len(env.coords)
+    start, heading, destination = [a.ravel() for a in np.meshgrid(
+        np.arange(n_locs), np.arange(4), np.arange(n_locs), indexing='ij')]
+    valid = env.compute_dist(start, destination) >= env.min_trip_dist
+    return start[valid], heading[valid], destination[valid]
+
+
+def greedy_policy(policy):
+    """Action index per state, from a QTable or such an array."""
+    if isinstance(policy, QTable):
+        return policy.greedy_actions()
+    return np.asarray(policy)
+
+
+def evaluate(policy, num_dummies=3, seed=0, enforce_deadline=True):
+    """Score a fixed policy on every possible trip, all at once.
+
+    policy is a QTable, whose highest-Q action is taken in each state
+    (the first one on ties), or an array of action indices indexed by
+    QTable state (e.g. from QTable.greedy_actions()).  Each trip runs in
+    its own copy of a BatchEnvironment, with traffic seeded by seed, so
+    the scores are deterministic.  Returns the number of trips, the
+    success rate, the mean number of steps per trip and the rate of
+    invalid moves per step.
+    """
+    actions = greedy_policy(policy)
+    probe = BatchEnvironment(1)
+    start, heading, destination = all_trips(probe)
+
+    env = BatchEnvironment(len(start), num_dummies=num_dummies, enforce_deadline=enforce_deadline, seed=seed)
+    env.reset(start=start, heading=heading, destination=destination)
+    n_steps = np.zeros(env.n_envs, dtype=int)
+    n_invalid = np.zeros(env.n_envs, dtype=int)
+    success = np.zeros(env.n_envs, dtype=bool)
+    while not env.done.all():
+        active = ~env.done
+        inputs = env.sense()
+        state = QTable.encode_codes(env.get_next_waypoint(), inputs['light'], inputs['left'], inputs['oncoming'])
+        reward = env.act(actions[state])
+        n_steps += active
+        n_invalid += active & (reward == -1)
+        success |= active & (reward > 9)
+
+    return {'trips': env.n_envs, 'success_rate': success.mean(),
+            'mean_steps': n_steps.mean(), 'invalid_rate': n_invalid.sum() / float(n_steps.sum())}
@@ -0,0 +1,108 @@
+import csv
+
+# Event levels; a sink receives the events at or above its level.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100
+
+# Field names and console message of each trial lifecycle event.
+events = {
+    'trial': (('trial',),
+        "Simulator.run(): Trial {trial}"),
+    'reset': (('start', 'destination', 'deadline'),
+        "Environment.reset(): Trial set up with start = {start}, destination = {destination}, deadline = {deadline}"),
+    'route': (('destination',),
+        "RoutePlanner.route_to(): destination = {destination}"),
+    'arrived': ((),
+        "Environment.act(): Primary agent has reached destination!"),
+    'out_of_time': ((),
+        "Environment.step(): Primary agent ran out of time! Trial aborted."),
+    'hard_time_limit': (('hard_time_limit',),
+        "Environment.step(): Primary agent hit hard time limit ({hard_time_limit})! Trial aborted."),
+    'negative': (('trial', 'waypoint', 'light', 'left', 'oncoming', 'action', 'reward'),
+        "Negative {trial},{waypoint},{light},{left},{oncoming},{action},{reward}"),
+    'run_summary': (('steps', 'secs', 'steps_per_sec'),
+        "Simulator.run_fast(): {steps} steps in {secs:.3f} secs ({steps_per_sec:.0f} steps/sec)"),
+    'early_stop': (('trial', 'reason'),
+        "EarlyStopping(): Run stopped after trial {trial}: {reason}"),
+}
+
+
+class EventSink(object):
+    """Receives trial lifecycle events, and discards them.
+
+    Callers check `sink.level <= LEVEL` before building an event, so a
+    sink at level OFF costs a single comparison per event.
+    """
+
+    level = OFF
+
+    def emit(self, level, event, *values):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class ConsoleSink(EventSink):
+    """Prints events, in the format of the original [debug] messages."""
+
+    def __init__(self, level=INFO):
+        self.level = level
+
+    def emit(self, level, event, *values):
+        fields, message = events[event]
+        print message.format(**dict(zip(fields, values)))
+
+
+class CSVSink(EventSink):
+    """Writes events as CSV rows of (level, event, values...).
+
+    Rows are buffered in memory and written buffer_size at a time;
+    call close() (or flush()) once the run is over.
+    """
+
+    def __init__(self, f, level=DEBUG, buffer_size=4096):
+        self.owns_file = isinstance(f, basestring)
+        self.file = open(f, 'wb') if self.owns_file else f
+        self.writer = csv.writer(self.file)
+        self.level = level
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def emit(self, level, event, *values):
+        self.buffer.append((level, event) + values)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.buffer)
+        del self.buffer[:]
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.owns_file:
+            self.file.close()
+
+
+class LevelFilter(EventSink):
+    """Passes on to sink only the events at or above level."""
+
+    def __init__(self, sink, level):
+        self.sink = sink
+        self.level = max(level, sink.level)
+
+    def emit(self, level, event, *values):
+        if level >= self.level:
+            self.sink.emit(level, event, *values)
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
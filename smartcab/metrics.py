@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+
+
+class RollingMetrics(object):
+    """Online statistics of a learning run, updated in O(1).
+
+    Keeps the outcome of the last `window` trials in ring buffers, with
+    running sums, for the windowed success rate and the rates of invalid
+    and off-waypoint actions per step; and a running mean and variance
+    of the reward per step over the whole run (Welford's algorithm).
+
+    Attach to a LearningAgent by setting agent.metrics; the agent then
+    calls add_step() after every step and end_trial() at the end of
+    every trial, so the statistics can be read while Simulator.run() is
+    going, e.g. from a Simulator callback.
+    """
+
+    def __init__(self, window=20):
+        self.window = window
+        self.success = np.zeros(window)
+        self.invalid = np.zeros(window)
+        self.wander = np.zeros(window)
+        self.steps = np.zeros(window)
+        self.sums = np.zeros(4)  # success, invalid, wander, steps over the window
+        self.n_trials = 0
+        self.trial_steps = 0  # steps in the current trial
+
+        # Reward per step
+        self.n_steps = 0
+        self.reward_mean = 0.0
+        self.reward_m2 = 0.0  # sum of squared deviations from the mean
+
+    def add_step(self, reward):
+        self.trial_steps += 1
+        self.n_steps += 1
+        delta = reward - self.reward_mean
+        self.reward_mean += delta / self.n_steps
+        self.reward_m2 += delta * (reward - self.reward_mean)
+
+    def end_trial(self, success, invalid, wander):
+        i = self.n_trials % self.window
+        outcome = (success, invalid, wander, self.trial_steps)
+        if self.n_trials >= self.window:
+            self.sums -= (self.success[i], self.invalid[i], self.wander[i], self.steps[i])
+        self.sums += outcome
+        self.success[i], self.invalid[i], self.wander[i], self.steps[i] = outcome
+        self.n_trials += 1
+        self.trial_steps = 0
+
+    @property
+    def success_rate(self):
+        """Fraction of successful trials, over the window."""
+        return self.sums[0] / min(self.n_trials, self.window) if self.n_trials else float('nan')
+
+    @property
+    def invalid_rate(self):
+        """Invalid actions per step, over the window."""
+        return self.sums[1] / self.sums[3] if self.sums[3] else float('nan')
+
+    @property
+    def wander_rate(self):
+        """Off-waypoint actions per step, over the window."""
+        return self.sums[2] / self.sums[3] if self.sums[3] else float('nan')
+
+    @property
+    def reward_var(self):
+        return self.reward_m2 / (self.n_steps - 1) if self.n_steps > 1 else float('nan')
+
+    @property
+    def reward_std(self):
+        return math.sqrt(self.reward_var)
+
+    def summary(self):
+        return {'trials': self.n_trials, 'steps': self.n_steps,
+                'success_rate': self.success_rate, 'invalid_rate': self.invalid_rate, 'wander_rate': self.wander_rate,
+                'reward_mean': self.reward_mean, 'reward_std': self.reward_std}
+
+    def __str__(self):
+        return "trials: {trials}, success rate: {success_rate:.2f}, invalid/step: {invalid_rate:.3f}, off-waypoint/step: {wander_rate:.3f}, reward: {reward_mean:.2f} +/- {reward_std:.2f}".format(**self.summary())
@@ -1,21 +1,59 @@
-import random
+from collections import OrderedDict
+
+import numpy as np
+
+from environment import Environment
+from events import DEBUG
 
 class RoutePlanner(object):
-    """Silly route planner that is meant for a perpendicular grid network."""
+    """Silly route planner that is meant for a perpendicular grid network.
+
+    The next waypoint only depends on (location, heading, destination),
+    so it is precomputed once per destination into a table (see
+    route_table()) and next_waypoint() is a single lookup.  Tables of
+    the max_routes destinations used last are kept.  On grids
+    larger than max_table_size intersections, waypoints are computed on
+    demand.
+    """
 
-    def __init__(self, env, agent):
+    max_table_size = 4096
+    max_routes = 256
+    tables = {}  # (planner class, grid bounds) -> waypoint table, for batched callers
+    routes = OrderedDict()  # (planner class, grid bounds, destination number) -> route table, least recently used first
+    grids = {}  # grid bounds -> (grid_locations(), {location: intersection number})
+    heading_ids = dict((heading, h) for h, heading in enumerate(Environment.valid_headings))
+
+    def __init__(self, env, agent, rng=None):
         self.env = env
         self.agent = agent
+        self.rng = rng if rng is not None else agent.rng
         self.destination = None
+        self.route = None
 
     def route_to(self, destination=None):
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
-        print "RoutePlanner.route_to(): destination = {}".format(destination)  # [debug]
+        self.destination = destination if destination is not None else self.rng.choice(self.env.locations)
+        if len(self.env.locations) <= self.max_table_size:
+            self.location_ids = self.grid(self.env.bounds)[1]
+            self.route = self.route_table(self.env.bounds, self.location_ids[self.destination])
+        else:
+            self.route = None  # see waypoint()
+        if self.env.sink.level <= DEBUG:
+            self.env.sink.emit(DEBUG, 'route', destination)
 
     def next_waypoint(self):
-        location = self.env.agent_states[self.agent]['location']
-        heading = self.env.agent_states[self.agent]['heading']
-        delta = (self.destination[0] - location[0], self.destination[1] - location[1])
+        location = self.env.get_location(self.agent)
+        heading = self.env.get_heading(self.agent)
+        if self.route is None:
+            return self.waypoint(location, heading)
+        return Environment.valid_actions[self.route[self.location_ids[location], self.heading_ids[heading]]]
+
+    def waypoint(self, location, heading):
+        """Next waypoint computed directly, for grids without a table."""
+        return self.compute_waypoint(location, heading, self.destination)
+
+    @staticmethod
+    def compute_waypoint(location, heading, destination):
+        delta = (destination[0] - location[0], destination[1] - location[1])
         if delta[0] == 0 and delta[1] == 0:
             return None
         elif delta[0] != 0:  # EW difference
@@ -36,3 +74,131 @@ class RoutePlanner(object):
                 return 'right'
             else:
                 return 'left'
+
+    @staticmethod
+    def grid_locations(bounds):
+        """Intersections of a grid, in the order of Environment.locations."""
+        return [(x, y) for x in xrange(bounds[0], bounds[2] + 1) for y in xrange(bounds[1], bounds[3] + 1)]
+
+    @classmethod
+    def grid(cls, bounds):
+        """grid_locations() and the number of each intersection, built
+        once per grid."""
+        bounds = tuple(bounds)
+        if bounds not in cls.grids:
+            locations = cls.grid_locations(bounds)
+            cls.grids[bounds] = (locations, dict((location, l) for l, location in enumerate(locations)))
+        return cls.grids[bounds]
+
+    @classmethod
+    def waypoint_table(cls, bounds):
+        """Next waypoint for every (destination, location, heading) of a grid.
+
+        Returns an array indexed by intersection numbers (as in
+        grid_locations()) and heading numbers (as in
+        Environment.valid_headings), holding indices into
+        Environment.valid_actions.  Built once per grid, and shared by
+        all planners; also usable for batched lookups.
+        """
+        key = (cls, tuple(bounds))
+        if key not in cls.tables:
+            locations = cls.grid(bounds)[0]
+            cls.tables[key] = np.array([cls.destination_table(bounds, d) for d in xrange(len(locations))], dtype=np.int8)
+        return cls.tables[key]
+
+    @classmethod
+    def destination_table(cls, bounds, d):
+        """Next waypoint for every (location, heading), towards intersection d."""
+        locations = cls.grid(bounds)[0]
+        destination = locations[d]
+        return [[Environment.valid_actions.index(cls.compute_waypoint(location, heading, destination))
+                 for heading in Environment.valid_headings]
+                for location in locations]
+
+    @classmethod
+    def route_table(cls, bounds, d):
+        """Next waypoint for every (location, heading) towards intersection
+        d: the row of waypoint_table() for d, searched for that
+        destination only (or taken from the full table if a batched
+        caller already built it).  Kept for the max_routes destinations
+        used last, and shared by all planners of a grid."""
+        key = (cls, tuple(bounds), d)
+        route = cls.routes.pop(key, None)
+        if route is None:
+            table = cls.tables.get(key[:2])
+            route = table[d] if table is not None else np.asarray(cls.destination_table(bounds, d), dtype=np.int8)
+        cls.routes[key] = route
+        if len(cls.routes) > cls.max_routes:
+            cls.routes.popitem(last=False)
+        return route
+
+
+class ShortestPathPlanner(RoutePlanner):
+    """Route planner that follows shortest paths on the wrap-around grid.
+
+    Environment.act() wraps agents around the edges of the grid, which
+    RoutePlanner ignores, sending cabs the long way round.  This planner
+    searches the road network including the wrap-around roads,
+    breadth-first over (location, heading) states since a cab cannot
+    U-turn, and suggests the action starting a shortest path.
+    """
+
+    preference = ('forward', 'right', 'left')  # order in which ties are broken
+    turns = {'forward': 0, 'left': 1, 'right': 3}  # heading change, as in Environment.act()
+    moves = {}  # grid bounds -> transitions()
+
+    @classmethod
+    def transitions(cls, bounds):
+        """State reached by each action in preference order, from each state.
+
+        States are numbered location * 4 + heading.
+        """
+        bounds = tuple(bounds)
+        if bounds in cls.moves:
+            return cls.moves[bounds]
+        cols, rows = bounds[2] - bounds[0] + 1, bounds[3] - bounds[1] + 1
+        headings = Environment.valid_headings
+        moves = np.empty((cols * rows * len(headings), len(cls.preference)), dtype=int)
+        for l, (x, y) in enumerate(cls.grid_locations(bounds)):
+            for h in xrange(len(headings)):
+                for k, action in enumerate(cls.preference):
+                    heading = (h + cls.turns[action]) % len(headings)
+                    dx, dy = headings[heading]
+                    ahead = ((x + dx - bounds[0]) % cols) * rows + (y + dy - bounds[1]) % rows  # wrap-around
+                    moves[l * len(headings) + h, k] = ahead * len(headings) + heading
+        cls.moves[bounds] = moves
+        return moves
+
+    @classmethod
+    def destination_table(cls, bounds, d):
+        moves = cls.transitions(bounds)
+        n_headings = len(Environment.valid_headings)
+
+        # Breadth-first search backwards from the destination: each pass
+        # extends the set of states within reach by one move
+        dist = np.full(len(moves), np.inf)
+        dist[d * n_headings:(d + 1) * n_headings] = 0
+        while True:
+            reach = np.minimum(dist, dist[moves].min(axis=1) + 1)
+            reach[d * n_headings:(d + 1) * n_headings] = 0
+            if (reach == dist).all():
+                break
+            dist = reach
+
+        codes = np.array([Environment.valid_actions.index(action) for action in cls.preference])
+        waypoints = codes[dist[moves].argmin(axis=1)]
+        waypoints[d * n_headings:(d + 1) * n_headings] = Environment.valid_actions.index(None)
+        return waypoints.reshape(-1, n_headings)
+
+    def waypoint(self, location, heading):
+        """Stand-in for the search on grids without a table: the turn
+        logic of RoutePlanner.compute_waypoint(), towards the destination
+        taken the shorter way around each axis."""
+        cols, rows = self.env.grid_size
+        dx = self.destination[0] - location[0]
+        dy = self.destination[1] - location[1]
+        if 2 * abs(dx) > cols or (2 * abs(dx) == cols and dx * heading[0] < 0):
+            dx -= cols if dx > 0 else -cols  # around the edge
+        if 2 * abs(dy) > rows or (2 * abs(dy) == rows and dy * heading[1] < 0):
+            dy -= rows if dy > 0 else -rows
+        return self.compute_waypoint(location, heading, (location[0] + dx, location[1] + dy))
@@ -0,0 +1,53 @@
+import timeit
+
+clock = timeit.default_timer
+
+
+class PhaseStats(object):
+    """Cumulative time and call count of each phase of a run.
+
+    Phases are timed by replacing methods with timing wrappers on the
+    instances being profiled (see attach()), so code that is not being
+    profiled runs unchanged, at no cost.  Phases nest: 'act' includes
+    the sense() it makes, and 'update:<class>' the sense() and act()
+    made by agents of that class.
+    """
+
+    def __init__(self):
+        self.time = {}  # phase -> cumulative secs
+        self.calls = {}  # phase -> no. of calls
+        self.attached = []  # (obj, method name) pairs
+
+    def add(self, phase, elapsed):
+        self.time[phase] = self.time.get(phase, 0.0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def attach(self, obj, name, phase):
+        """Time every call to obj.name() as phase."""
+        fn = getattr(obj, name)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, clock() - start)
+        setattr(obj, name, timed)
+        self.attached.append((obj, name))
+
+    def detach(self):
+        """Remove all timing wrappers, restoring the original methods."""
+        for obj, name in reversed(self.attached):
+            delattr(obj, name)
+        self.attached = []
+
+    def reset(self):
+        self.time.clear()
+        self.calls.clear()
+
+    def report(self):
+        """Table of phases, slowest first."""
+        lines = ["{:<24} {:>10} {:>10} {:>10}".format('phase', 'calls', 'secs', 'us/call')]
+        for phase in sorted(self.time, key=self.time.get, reverse=True):
+            lines.append("{:<24} {:>10} {:>10.3f} {:>10.2f}".format(
+                phase, self.calls[phase], self.time[phase], 1e6 * self.time[phase] / self.calls[phase]))
+        return "\n".join(lines)
@@ -0,0 +1,125 @@
+import itertools
+
+import numpy as np
+
+from environment import Environment
+
+
+class QTable(object):
+    """Q-values and visit counts of every state-action pair, in arrays.
+
+    A state is the (waypoint, light, left, oncoming) tuple returned by
+    LearningAgent.get_state().  The state space is small and fixed, so
+    each state maps to a dense integer index, and Q-values and visit
+    counts are stored in (n_states, n_actions) arrays indexed by it.
+    Actions are indexed as in Environment.valid_actions.
+
+    A Q-table can be shared by several learners: with batch_size > 1,
+    updates are staged (see stage()) and written batch_size at a time,
+    typically once per step for batch_size learners.
+    """
+
+    actions = tuple(Environment.valid_actions)  # None, forward, left, right
+    lights = ('red', 'green')  # indexed as batch.RED, batch.GREEN
+    n_states = len(actions) * len(lights) * len(actions) * len(actions)
+
+    def __init__(self, optimism=5, batch_size=1):
+        self.optimism = optimism  # the Q-Value to assign new states
+        self.Q = np.full((self.n_states, len(self.actions)), optimism, dtype=float)
+        self.visits = np.ones((self.n_states, len(self.actions)), dtype=int)  # used to reduce alpha
+
+        # Staged updates, see stage()
+        self.batch_size = batch_size
+        self.staged_states = np.zeros(batch_size, dtype=int)
+        self.staged_actions = np.zeros(batch_size, dtype=int)
+        self.staged_targets = np.zeros(batch_size)
+        self.staged_alphas = np.zeros(batch_size)
+        self.staged_agents = [None] * batch_size  # whose max_dQ each update counts towards
+        self.n_staged = 0
+
+        # state tuple -> index, so that encoding a state costs one lookup
+        self.index = {}
+        for state in itertools.product(self.actions, self.lights, self.actions, self.actions):
+            self.index[state] = self.encode_codes(*[
+                values.index(value) for values, value in zip((self.actions, self.lights, self.actions, self.actions), state)])
+
+    def encode(self, state):
+        """Index of a (waypoint, light, left, oncoming) state tuple."""
+        return self.index[state]
+
+    @staticmethod
+    def encode_codes(waypoint, light, left, oncoming):
+        """Index of an integer-coded state; also works on arrays of codes."""
+        return ((waypoint * 2 + light) * 4 + left) * 4 + oncoming
+
+    def decode(self, index):
+        """State tuple of an index."""
+        index, oncoming = divmod(index, 4)
+        index, left = divmod(index, 4)
+        waypoint, light = divmod(index, 2)
+        return (self.actions[waypoint], self.lights[light], self.actions[left], self.actions[oncoming])
+
+    def update_batch(self, states, actions, targets, alphas):
+        """Move Q[states, actions] towards targets, by alphas, all at once.
+
+        Updates of the same state-action pair within a batch are applied
+        one after the other, in batch order, as separate writes would.
+        Returns the change each update made to its Q-value.
+        """
+        states, actions = np.asarray(states), np.asarray(actions)
+        targets = np.broadcast_to(targets, states.shape)
+        alphas = np.broadcast_to(alphas, states.shape)
+        changes = np.zeros(len(states))
+
+        # Rank of each update among those of its pair; one round per rank
+        pairs = states * len(self.actions) + actions
+        order = np.argsort(pairs, kind='mergesort')
+        sorted_pairs = pairs[order]
+        starts = np.flatnonzero(np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]])
+        rank = np.empty(len(states), dtype=int)
+        rank[order] = np.arange(len(states)) - np.repeat(starts, np.diff(np.r_[starts, len(states)]))
+
+        for r in range(rank.max() + 1 if len(states) else 0):
+            i = np.flatnonzero(rank == r)
+            s, a = states[i], actions[i]
+            Q_old = self.Q[s, a]
+            Q_new = (1.0 - alphas[i]) * Q_old + alphas[i] * targets[i]
+            self.Q[s, a] = Q_new
+            changes[i] = np.abs(Q_new - Q_old)
+        return changes
+
+    def stage(self, state, action, target, alpha, agent=None):
+        """Queue an update for update_batch(); the queue is written once
+        batch_size updates are staged.  The change made is then recorded
+        in agent.max_dQ, if an agent is given."""
+        i = self.n_staged
+        self.staged_states[i] = state
+        self.staged_actions[i] = action
+        self.staged_targets[i] = target
+        self.staged_alphas[i] = alpha
+        self.staged_agents[i] = agent
+        self.n_staged = i + 1
+        if self.n_staged == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the staged updates."""
+        n = self.n_staged
+        if n:
+            changes = self.update_batch(self.staged_states[:n], self.staged_actions[:n], self.staged_targets[:n], self.staged_alphas[:n])
+            for agent, change in zip(self.staged_agents[:n], changes):
+                if agent is not None:
+                    agent.max_dQ = max(agent.max_dQ, change)
+            self.n_staged = 0
+
+    def greedy_actions(self, rng=None):
+        """Highest-Q action of every state, as an array of action indices.
+
+        Ties are broken at random with rng (a random.Random), once, as
+        LearningAgent.update() would when acting; without rng the first
+        tied action is taken.
+        """
+        if rng is None:
+            return self.Q.argmax(axis=1)
+        best = self.Q == self.Q.max(axis=1)[:, np.newaxis]
+        return np.array([rng.choice(np.flatnonzero(ties).tolist()) for ties in best])
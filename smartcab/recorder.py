@@ -0,0 +1,108 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from environment import Environment
+from qtable import QTable
+
+columns = (
+    ('trial', np.int32), ('t', np.int32),
+    ('waypoint', np.int8), ('light', np.int8), ('left', np.int8), ('oncoming', np.int8),  # state
+    ('action', np.int8), ('reward', np.float32),
+    ('x', np.int16), ('y', np.int16), ('deadline', np.int32))
+
+
+class TrajectoryRecorder(object):
+    """Records every step of an agent as rows of integer-coded columns.
+
+    Rows hold (trial, t, state, action, reward, location, deadline), the
+    state being (waypoint, light, left, oncoming) and the location
+    (x, y) where the action was taken; actions and waypoints are indices
+    into Environment.valid_actions, lights into QTable.lights.  Rows are
+    buffered in fixed-size arrays and written chunk_size at a time, each
+    chunk to its own shard in the directory path: Parquet files when
+    pyarrow is installed (or format='parquet'), NPZ files otherwise.
+    Call close() (or flush()) once the run is over, and
+    read_trajectories() to load them back.
+
+    Attach to a LearningAgent by setting agent.recorder.
+    """
+
+    def __init__(self, path, chunk_size=65536, format=None):
+        if format is None:
+            format = 'parquet' if pyarrow is not None else 'npz'
+        if format not in ('parquet', 'npz'):
+            raise ValueError("Unknown format: {}".format(format))
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError("pyarrow is required to write Parquet shards")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.format = format
+        self.chunk_size = chunk_size
+        self.buffers = dict((name, np.empty(chunk_size, dtype=dtype)) for name, dtype in columns)
+        self.n_rows = 0  # rows in the buffers
+        self.n_shards = len(glob.glob(os.path.join(path, 'part-*')))  # append to earlier runs
+
+        self.action_ids = dict((action, a) for a, action in enumerate(Environment.valid_actions))
+        self.light_ids = dict((light, l) for l, light in enumerate(QTable.lights))
+
+    def record(self, trial, t, state, action, reward, location, deadline):
+        i = self.n_rows
+        action_ids = self.action_ids
+        b = self.buffers
+        b['trial'][i] = trial
+        b['t'][i] = t
+        b['waypoint'][i] = action_ids[state[0]]
+        b['light'][i] = self.light_ids[state[1]]
+        b['left'][i] = action_ids[state[2]]
+        b['oncoming'][i] = action_ids[state[3]]
+        b['action'][i] = action_ids[action]
+        b['reward'][i] = reward
+        b['x'][i] = location[0]
+        b['y'][i] = location[1]
+        b['deadline'][i] = deadline
+        self.n_rows = i + 1
+        if self.n_rows == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new shard."""
+        if self.n_rows == 0:
+            return
+        chunk = dict((name, self.buffers[name][:self.n_rows]) for name, dtype in columns)
+        shard = os.path.join(self.path, 'part-{:05d}.{}'.format(self.n_shards, self.format))
+        if self.format == 'parquet':
+            table = pyarrow.Table.from_arrays([pyarrow.array(chunk[name]) for name, dtype in columns],
+                                              names=[name for name, dtype in columns])
+            pyarrow.parquet.write_table(table, shard)
+        else:
+            with open(shard, 'wb') as f:
+                np.savez(f, **chunk)
+        self.n_shards += 1
+        self.n_rows = 0
+
+    def close(self):
+        self.flush()
+
+
+def read_trajectories(path):
+    """All shards written by TrajectoryRecorders to path, as a DataFrame."""
+    frames = []
+    for shard in sorted(glob.glob(os.path.join(path, 'part-*'))):
+        if shard.endswith('.parquet'):
+            frames.append(pyarrow.parquet.read_table(shard).to_pandas())
+        else:
+            with np.load(shard) as chunk:
+                frames.append(pd.DataFrame(dict((name, chunk[name]) for name, dtype in columns)))
+    if not frames:
+        return pd.DataFrame(columns=[name for name, dtype in columns])
+    return pd.concat(frames, ignore_index=True)[[name for name, dtype in columns]]
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """Fixed-capacity ring buffer of Q-learning transitions.
+
+    Transitions (s, a, r, s') are stored as integer-coded arrays, s and
+    s' being QTable state indices and a an action index.  Every `every`
+    transitions added, update() replays a mini-batch of batch_size
+    transitions sampled uniformly from the buffer, as one vectorized
+    QTable.update_batch().  The oldest transitions are overwritten once
+    the buffer is full.
+
+    Attach to a LearningAgent by setting agent.replay.
+    """
+
+    def __init__(self, capacity=10000, batch_size=32, every=10, seed=None):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.every = every
+        self.rng = np.random.RandomState(seed)
+        self.states = np.zeros(capacity, dtype=np.int16)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype=np.int16)
+        self.n_added = 0
+
+    def __len__(self):
+        return min(self.n_added, self.capacity)
+
+    def add(self, s, a, r, s_prime):
+        i = self.n_added % self.capacity
+        self.states[i] = s
+        self.actions[i] = a
+        self.rewards[i] = r
+        self.next_states[i] = s_prime
+        self.n_added += 1
+
+    def due(self):
+        """Whether a mini-batch is to be replayed after the last add()."""
+        return self.n_added % self.every == 0
+
+    def update(self, qtable, gamma, alpha=1):
+        """Replay a mini-batch into qtable.
+
+        Each transition moves Q[s, a] towards r + gamma * max Q[s'], by
+        the learning rate the agent would use for that pair now (alpha
+        divided by its visit count); visit counts are left unchanged.
+        A transition sampled more than once is replayed as many times,
+        one after the other, so Q[s, a] stays between its old value and
+        the target.
+        """
+        idx = self.rng.randint(0, len(self), size=self.batch_size)
+        s = self.states[idx]
+        a = self.actions[idx]
+        targets = self.rewards[idx] + gamma * qtable.Q[self.next_states[idx]].max(axis=1)
+        qtable.update_batch(s, a, targets, float(alpha) / qtable.visits[s, a])
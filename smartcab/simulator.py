@@ -1,8 +1,9 @@
 import os
 import time
-import random
 import importlib
 
+from events import INFO
+
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
 
@@ -21,7 +22,7 @@ class Simulator(object):
         'orange'  : (255, 128,   0)
     }
 
-    def __init__(self, env, size=None, update_delay=1.0, display=True):
+    def __init__(self, env, size=None, update_delay=1.0, display=True, frame_rate=30):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 1) * self.env.block_size)
         self.width, self.height = self.size
@@ -35,7 +36,11 @@ class Simulator(object):
         self.current_time = 0.0
         self.last_updated = 0.0
         self.update_delay = update_delay  # duration between each step (in secs)
+        self.frame_interval = 1.0 / frame_rate  # duration between each GUI frame (in secs), whatever the step rate
+        self.last_rendered = 0.0
 
+        self.stats = None  # PhaseStats, when profiling (see enable_profiling())
+        self.callbacks = []  # called as callback(simulator, trial) after each trial; may set self.quit
         self.display = display
         if self.display:
             try:
@@ -43,12 +48,14 @@ class Simulator(object):
                 self.pygame.init()
                 self.screen = self.pygame.display.set_mode(self.size)
 
-                self.frame_delay = max(1, int(self.update_delay * 1000))  # delay between GUI frames in ms (min: 1)
+                self.frame_delay = max(1, int(self.frame_interval * 1000))  # delay between GUI frames in ms (min: 1)
                 self.agent_sprite_size = (32, 32)
                 self.agent_circle_radius = 10  # radius of circle, when using simple representation
+                self.sprites = {}  # color -> {heading: sprite rotated to face it}
                 for agent in self.env.agent_states:
-                    agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
-                    agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+                    if agent.color not in self.sprites:
+                        self.sprites[agent.color] = self.load_sprites(agent.color)
+                self.background = self.render_background()
 
                 self.font = self.pygame.font.Font(None, 28)
                 self.paused = False
@@ -60,12 +67,18 @@ class Simulator(object):
                 print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
 
     def run(self, n_trials=1):
+        if not self.display and self.update_delay == 0:
+            return self.run_fast(n_trials)
+
         self.quit = False
+        sink = self.env.sink
         for trial in xrange(n_trials):
-            print "Simulator.run(): Trial {}".format(trial)  # [debug]
+            if sink.level <= INFO:
+                sink.emit(INFO, 'trial', trial)
             self.env.reset()
             self.current_time = 0.0
             self.last_updated = 0.0
+            self.last_rendered = -self.frame_interval  # render the first step
             self.start_time = time.time()
             while True:
                 try:
@@ -73,49 +86,118 @@ class Simulator(object):
                     self.current_time = time.time() - self.start_time
                     #print "Simulator.run(): current_time = {:.3f}".format(self.current_time)
 
-                    # Handle GUI events
-                    if self.display:
-                        for event in self.pygame.event.get():
-                            if event.type == self.pygame.QUIT:
-                                self.quit = True
-                            elif event.type == self.pygame.KEYDOWN:
-                                if event.key == 27:  # Esc
-                                    self.quit = True
-                                elif event.unicode == u' ':
-                                    self.paused = True
-
-                        if self.paused:
-                            self.pause()
-
                     # Update environment
                     if self.current_time - self.last_updated >= self.update_delay:
                         self.env.step()
                         self.last_updated = self.current_time
 
-                    # Render GUI and sleep
+                    # Handle GUI events and render GUI, once per frame
                     if self.display:
-                        self.render()
-                        self.pygame.time.wait(self.frame_delay)
+                        if self.current_time - self.last_rendered >= self.frame_interval:
+                            for event in self.pygame.event.get():
+                                if event.type == self.pygame.QUIT:
+                                    self.quit = True
+                                elif event.type == self.pygame.KEYDOWN:
+                                    if event.key == 27:  # Esc
+                                        self.quit = True
+                                    elif event.unicode == u' ':
+                                        self.paused = True
+
+                            if self.paused:
+                                self.pause()
+
+                            self.render()
+                            self.last_rendered = self.current_time
+
+                        # Sleep until the next step or frame is due, if any
+                        wait = min(self.last_updated + self.update_delay, self.last_rendered + self.frame_interval) - self.current_time
+                        if wait > 0:
+                            self.pygame.time.wait(max(1, int(wait * 1000)))
                 except KeyboardInterrupt:
                     self.quit = True
                 finally:
                     if self.quit or self.env.done:
                         break
 
+            for callback in self.callbacks:
+                callback(self, trial)
             if self.quit:
                 break
+        sink.flush()
 
-    def render(self):
-        # Clear screen
-        self.screen.fill(self.bg_color)
+    def run_fast(self, n_trials=1):
+        """Run trials headless, stepping the environment in a tight loop.
 
-        # Draw elements
-        # * Static elements
+        Ignores update_delay and the display, and reports the step rate
+        once all trials are done (or on Ctrl+C).  Returns steps/sec.
+        """
+        self.quit = False
+        env = self.env
+        sink = env.sink
+        n_steps = 0
+        start_time = time.time()
+        try:
+            for trial in xrange(n_trials):
+                if sink.level <= INFO:
+                    sink.emit(INFO, 'trial', trial)
+                env.reset()
+                while not env.done:
+                    env.step()
+                    n_steps += 1
+                for callback in self.callbacks:
+                    callback(self, trial)
+                if self.quit:
+                    break
+        except KeyboardInterrupt:
+            self.quit = True
+
+        elapsed = time.time() - start_time
+        steps_per_sec = n_steps / elapsed if elapsed > 0 else float('inf')
+        if sink.level <= INFO:
+            sink.emit(INFO, 'run_summary', n_steps, elapsed, steps_per_sec)
+        sink.flush()
+        return steps_per_sec
+
+    def enable_profiling(self):
+        """Time the phases of the environment's steps, and rendering.
+        Returns the PhaseStats collecting them."""
+        self.stats = self.env.enable_profiling()
+        if self.display:
+            self.stats.attach(self, 'render', 'render')
+        return self.stats
+
+    def load_sprites(self, color):
+        """Car sprite of a color, rotated once to each heading; None if
+        there is no image for it."""
+        try:
+            sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(color))), self.agent_sprite_size)
+        except Exception as e:
+            print "Simulator.load_sprites(): Unable to load car-{}.png; drawing simple agents.\n{}: {}".format(color, e.__class__.__name__, e)
+            return None
+        return {
+            (1, 0): sprite,
+            (-1, 0): self.pygame.transform.rotate(sprite, 180),
+            (0, -1): self.pygame.transform.rotate(sprite, 90),
+            (0, 1): self.pygame.transform.rotate(sprite, -90)}
+
+    def render_background(self):
+        """Static elements (roads and intersections), drawn once."""
+        background = self.pygame.Surface(self.size)
+        background.fill(self.bg_color)
         for road in self.env.roads:
-            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+            self.pygame.draw.line(background, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+
+        for intersection in self.env.intersections:
+            self.pygame.draw.circle(background, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
+        return background
 
+    def render(self):
+        # Clear screen, back to the static elements
+        self.screen.blit(self.background, (0, 0))
+
+        # Draw elements
+        # * Traffic lights
         for intersection, traffic_light in self.env.intersections.iteritems():
-            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
             if traffic_light.state:  # North-South is open
                 self.pygame.draw.line(self.screen, self.colors['green'],
                     (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size - 15),
@@ -126,26 +208,31 @@ class Simulator(object):
                     (intersection[0] * self.env.block_size + 15, intersection[1] * self.env.block_size), self.road_width)
 
         # * Dynamic elements
-        for agent, state in self.env.agent_states.iteritems():
+        for agent in self.env.agent_states:
+            location = self.env.get_location(agent)
+            heading = self.env.get_heading(agent)
+            destination = self.env.get_destination(agent)
             # Compute precise agent location here (back from the intersection some)
-            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius, 2 * state['heading'][1] * self.agent_circle_radius)
-            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
+            agent_offset = (2 * heading[0] * self.agent_circle_radius, 2 * heading[1] * self.agent_circle_radius)
+            agent_pos = (location[0] * self.env.block_size - agent_offset[0], location[1] * self.env.block_size - agent_offset[1])
             agent_color = self.colors[agent.color]
-            if hasattr(agent, '_sprite') and agent._sprite is not None:
+            sprites = self.sprites.get(agent.color)
+            if sprites is not None:
                 # Draw agent sprite (image), properly rotated
-                rotated_sprite = agent._sprite if state['heading'] == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if state['heading'][0] == -1 else state['heading'][1] * -90)
+                rotated_sprite = sprites[heading]
+                sprite_size = (rotated_sprite.get_width(), rotated_sprite.get_height())
                 self.screen.blit(rotated_sprite,
-                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
-                        agent._sprite_size[0], agent._sprite_size[1]))
+                    self.pygame.rect.Rect(agent_pos[0] - sprite_size[0] / 2, agent_pos[1] - sprite_size[1] / 2,
+                        sprite_size[0], sprite_size[1]))
             else:
                 # Draw simple agent (circle with a short line segment poking out to indicate heading)
                 self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
-                self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
+                self.pygame.draw.line(self.screen, agent_color, agent_pos, location, self.road_width)
             if agent.get_next_waypoint() is not None:
                 self.screen.blit(self.font.render(agent.get_next_waypoint(), True, agent_color, self.bg_color), (agent_pos[0] + 10, agent_pos[1] + 10))
-            if state['destination'] is not None:
-                self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 6)
-                self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 15, 2)
+            if destination is not None:
+                self.pygame.draw.circle(self.screen, agent_color, (destination[0] * self.env.block_size, destination[1] * self.env.block_size), 6)
+                self.pygame.draw.circle(self.screen, agent_color, (destination[0] * self.env.block_size, destination[1] * self.env.block_size), 15, 2)
 
         # * Overlays
         text_y = 10
@@ -0,0 +1,53 @@
+import numpy as np
+
+from events import INFO
+
+
+class EarlyStopping(object):
+    """Simulator callback ending a run once a LearningAgent has converged.
+
+    The run is stopped (by setting sim.quit) once the median, over the
+    last `patience` trials, of the largest change to a Q-value in each
+    trial (see LearningAgent.max_dQ) is below epsilon, and, if
+    min_success_rate is given, the windowed success rate of
+    agent.metrics (a RollingMetrics) reached it.  criterion, if given,
+    is a further condition, called as criterion(agent, trial) after each
+    trial.
+
+    The median rather than the largest change: with alpha decaying as
+    1/n, the first visits of rarely seen state-action pairs keep moving
+    some Q-value by several units now and then, however long the run.
+    The defaults stop the default agent after about 150 to 250 trials.
+
+    trials_run holds the number of trials run when the run stopped, or
+    None if it never did.
+    """
+
+    def __init__(self, agent, epsilon=0.02, patience=20, min_success_rate=None, criterion=None):
+        if min_success_rate is not None and agent.metrics is None:
+            raise ValueError("min_success_rate needs agent.metrics to be set")
+        self.agent = agent
+        self.epsilon = epsilon
+        self.patience = patience
+        self.min_success_rate = min_success_rate
+        self.criterion = criterion
+        self.max_dQ = np.zeros(patience)  # agent.max_dQ of the last patience trials
+        self.n_trials = 0
+        self.trials_run = None
+
+    def __call__(self, sim, trial):
+        agent = self.agent
+        self.max_dQ[self.n_trials % self.patience] = agent.max_dQ
+        self.n_trials += 1
+        if self.n_trials < self.patience or not np.median(self.max_dQ) < self.epsilon:
+            return
+        if self.min_success_rate is not None and not agent.metrics.success_rate >= self.min_success_rate:
+            return
+        if self.criterion is not None and not self.criterion(agent, trial):
+            return
+
+        sim.quit = True
+        self.trials_run = trial + 1
+        sink = agent.env.sink
+        if sink.level <= INFO:
+            sink.emit(INFO, 'early_stop', trial, "median max |dQ| < {} over {} trials".format(self.epsilon, self.patience))
@@ -0,0 +1,67 @@
+import itertools
+import multiprocessing
+
+import pandas as pd
+
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+from stopping import EarlyStopping
+
+
+def run_config(job):
+    """Train a LearningAgent with one set of parameters.
+
+    job is a (config, params, n_trials, seed, stopping) tuple, stopping
+    being None or EarlyStopping arguments; returns one row of
+    statistics per trial run.
+    """
+    config, params, n_trials, seed, stopping = job
+    env = Environment(seed=seed)
+    agent = env.create_agent(LearningAgent, n_trials=n_trials, **params)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    sim = Simulator(env, update_delay=0, display=False)
+    if stopping is not None:
+        sim.callbacks.append(EarlyStopping(agent, **stopping))
+    sim.run(n_trials=n_trials)
+
+    rows = []
+    for trial in xrange(env.trial + 1):
+        row = {'config': config, 'seed': seed, 'trial': trial,
+               'success': int(agent.success[trial]),
+               'invalid': int(agent.invalid[trial]),
+               'wander': int(agent.wander[trial])}
+        row.update(params)
+        rows.append(row)
+    return rows
+
+
+def sweep(grid, n_trials=100, seed=0, processes=None, stopping=None):
+    """Train one LearningAgent per point of a parameter grid, in parallel.
+
+    grid maps LearningAgent parameters (gamma, alpha, optimism) to lists
+    of values to try.  Every config runs in its own process from the
+    pool, with its own seed (seed + config number).  Returns a DataFrame
+    with one row per (config, trial).
+
+    stopping, a dict of EarlyStopping arguments (e.g. {'epsilon': 0.01,
+    'patience': 20}), ends each config's run once it has converged.
+    """
+    names = sorted(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    jobs = [(i, params, n_trials, seed + i, stopping) for i, params in enumerate(configs)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(run_config, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    columns = ['config', 'seed'] + names + ['trial', 'success', 'invalid', 'wander']
+    return pd.DataFrame([row for rows in results for row in rows], columns=columns)
+
+
+if __name__ == '__main__':
+    results = sweep({'gamma': [0.0, 0.03, 0.1, 0.33], 'optimism': [1, 5, 10]})
+    print results.groupby(['gamma', 'optimism'])[['success', 'invalid', 'wander']].mean()
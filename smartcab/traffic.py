@@ -0,0 +1,186 @@
+import numpy as np
+
+# Integer codes, as in batch.py: actions index into
+# Environment.valid_actions, headings into Environment.valid_headings (ENWS)
+NONE, FORWARD, LEFT, RIGHT = range(4)
+
+
+def lookup(keys, values):
+    """Position of each of values in the sorted array keys, or len(keys)
+    for values not in it."""
+    i = np.searchsorted(keys, values)
+    found = keys[np.minimum(i, len(keys) - 1)] == values
+    return np.where(found, i, len(keys))
+
+
+class TrafficController(object):
+    """Moves all the DummyAgents of an Environment in one batched pass.
+
+    Replaces the DummyAgent.update() calls of Environment.step(), with
+    the same outcome.  Locations, headings and waypoints of the dummies
+    are kept in arrays, and the inputs each dummy would sense are
+    computed for all of them at once, from the traffic at the start of
+    the step, by grouping agents by (intersection, heading).
+
+    DummyAgent.update() calls run one after the other, in creation
+    order, so a dummy may see traffic that earlier dummies changed
+    during the step.  That only matters to a dummy turning right on red
+    or left on green, the checks which depend on traffic, and only if an
+    earlier dummy may move away from or into the traffic it checks; a
+    dummy can only move along its waypoint, so these dummies are known
+    beforehand.
+    Only these are updated one by one, through DummyAgent.update();
+    the others move as decided in the batch.  New waypoints are drawn
+    from each dummy's generator, in creation order, so a seeded run
+    matches one without the controller step for step.
+    """
+
+    def __init__(self, env, dummies):
+        self.env = env
+        self.dummies = list(dummies)
+        self.dummy_set = set(self.dummies)
+        self._others = []  # agents updated individually, in creation order
+
+        # Road network: the intersection reached by leaving each one along
+        # each heading (with wrap-around), as in batch.BatchEnvironment
+        cols, rows = env.grid_size
+        self.location_ids = dict((location, l) for l, location in enumerate(env.locations))
+        coords = np.array(env.locations)
+        headings = np.array(env.valid_headings)
+        ahead = (coords[:, None, :] + headings[None, :, :] - env.bounds[:2]) % env.grid_size
+        self.neighbors = ahead[..., 0] * rows + ahead[..., 1]
+
+        # Traffic lights, which never change their initial state or period
+        lights = [env.intersections[location] for location in env.locations]
+        self.light_state = np.array([light.initial_state for light in lights])
+        self.light_period = np.array([light.period for light in lights])
+        self.periods = sorted(set(self.light_period.tolist()))
+        self.period_index = np.searchsorted(self.periods, self.light_period)
+
+        self.heading_ids = dict((heading, h) for h, heading in enumerate(env.valid_headings))
+        self.action_ids = dict((action, a) for a, action in enumerate(env.valid_actions))
+        self.order = np.array([env.agent_ids[dummy] for dummy in self.dummies], dtype=int)
+        self.load()
+
+    @property
+    def others(self):
+        """Agents of the environment which are not dummies."""
+        if len(self._others) + len(self.dummies) != len(self.env.agent_states):
+            self._others = [agent for agent in self.env.agent_states if agent not in self.dummy_set]
+        return self._others
+
+    def load(self):
+        """Read the state of the dummies from the environment, e.g. after
+        Environment.reset() placed them."""
+        states = self.env.agent_states
+        self.loc = np.array([self.location_ids[states[dummy].location] for dummy in self.dummies], dtype=int)
+        self.heading = np.array([self.heading_ids[states[dummy].heading] for dummy in self.dummies], dtype=int)
+        self.waypoint = np.array([self.action_ids[dummy.next_waypoint] for dummy in self.dummies], dtype=int)
+
+    def reset(self):
+        self.load()
+
+    def ns_open(self, loc):
+        """Whether the lights at intersections loc let NS traffic through."""
+        clock = self.env.light_clock
+        flips = np.array([clock.flips[period] + clock.t // period for period in self.periods])
+        return self.light_state[loc] != (flips[self.period_index[loc]] % 2 == 1)
+
+    def update(self, t):
+        env = self.env
+        n = len(self.dummies)
+        if n == 0:
+            return
+
+        # All agents at the start of the step: dummies, then the others
+        others = self.others
+        loc, heading, waypoint, order = self.loc, self.heading, self.waypoint, self.order
+        if others:
+            states = env.agent_states
+            loc = np.concatenate((loc, [self.location_ids[states[agent].location] for agent in others]))
+            heading = np.concatenate((heading, [self.heading_ids[states[agent].heading] for agent in others]))
+            waypoint = np.concatenate((waypoint, [self.action_ids[agent.get_next_waypoint()] for agent in others]))
+            order = np.concatenate((order, [env.agent_ids[agent] for agent in others]))
+
+        # Traffic at each occupied (intersection, heading), as sense()
+        # would see it from another heading: whether some agent there has
+        # 'forward' or 'left' as next waypoint, and the waypoint of the
+        # last one.  Groups are numbered by rank among the occupied ones,
+        # with one more, empty group for all the others.
+        groups, group = np.unique(loc * 4 + heading, return_inverse=True)
+        n_groups = len(groups)
+        has_forward = np.zeros(n_groups + 1, dtype=bool)
+        has_forward[group[waypoint == FORWARD]] = True
+        has_left = np.zeros(n_groups + 1, dtype=bool)
+        has_left[group[waypoint == LEFT]] = True
+        last = np.full(n_groups, -1, dtype=int)
+        np.maximum.at(last, group, order)
+        position = np.empty(len(env.agent_ids), dtype=int)
+        position[order] = np.arange(len(order))
+        last_waypoint = np.append(waypoint[position[last]], NONE)
+
+        # Right-of-way checks of DummyAgent.update(), for every dummy.
+        # Only two depend on the traffic: turning right on red, on that
+        # from the left, and turning left on green, on oncoming traffic.
+        loc, heading, waypoint = self.loc, self.heading, self.waypoint
+        green = self.ns_open(loc) == (heading % 2 == 1)  # N or S
+        oncoming = lookup(groups, loc * 4 + (heading + 2) % 4)
+        oncoming_blocks = ~has_left[oncoming] & ((last_waypoint[oncoming] == FORWARD) | (last_waypoint[oncoming] == RIGHT))
+        left_forward = has_forward[lookup(groups, loc * 4 + (heading + 3) % 4)]
+        move_okay = np.where(waypoint == FORWARD, green,
+                    np.where(waypoint == LEFT, green & ~oncoming_blocks,
+                             green | ~left_forward))  # right
+        sensitive = np.where(waypoint == LEFT, green, (waypoint == RIGHT) & ~green)
+        watched = loc * 4 + np.where(waypoint == LEFT, (heading + 2) % 4, (heading + 3) % 4)
+
+        # Where each dummy goes if it moves
+        new_heading = np.where(waypoint == LEFT, (heading + 1) % 4,
+                      np.where(waypoint == RIGHT, (heading + 3) % 4, heading))
+        new_loc = self.neighbors[loc, new_heading]
+
+        # Dummies whose checked traffic an earlier dummy may change before
+        # their turn, by leaving it or joining it.  Only dummies which may
+        # move do so: unaffected ones move as decided, affected ones
+        # might; starting from all the sensitive ones, each pass narrows
+        # down both sets.  Groups are again numbered among those left or
+        # reached.
+        index = np.arange(n)
+        groups, moves = np.unique(np.concatenate((loc * 4 + heading, new_loc * 4 + new_heading)), return_inverse=True)
+        here, there = moves[:n], moves[n:]
+        watched = lookup(groups, watched)
+        affected = sensitive
+        while True:
+            may_move = index[move_okay | affected]
+            first_at = np.full(len(groups) + 1, n, dtype=int)  # earliest dummy leaving each group
+            np.minimum.at(first_at, here[may_move], may_move)
+            first_to = np.full(len(groups) + 1, n, dtype=int)  # earliest dummy joining each group
+            np.minimum.at(first_to, there[may_move], may_move)
+            narrowed = sensitive & ((first_at[watched] < index) | (first_to[watched] < index))
+            if (narrowed == affected).all():
+                break
+            affected = narrowed
+
+        # Apply the moves in creation order: decided ones as decided,
+        # affected dummies through DummyAgent.update(), on the traffic as
+        # it is by their turn
+        states = env.agent_states
+        locations, headings, actions = env.locations, env.valid_headings, env.valid_actions
+        for i in np.flatnonzero(affected | move_okay).tolist():
+            dummy = self.dummies[i]
+            state = states[dummy]
+            if affected[i]:
+                dummy.update(t)
+                self.loc[i] = self.location_ids[state.location]
+                self.heading[i] = self.heading_ids[state.heading]
+                self.waypoint[i] = self.action_ids[dummy.next_waypoint]
+                continue
+            l, h = new_loc[i], new_heading[i]
+            location = locations[l]
+            env.remove_occupant(dummy, state.location)
+            env.add_occupant(dummy, location)
+            state.location = location
+            state.heading = headings[h]
+            dummy.next_waypoint = dummy.rng.choice(actions[1:])
+            self.loc[i] = l
+            self.heading[i] = h
+            self.waypoint[i] = self.action_ids[dummy.next_waypoint]